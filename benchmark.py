@@ -0,0 +1,440 @@
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+import main
+
+
+def format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.3f} ms"
+
+
+def make_frame(rng: random.Random, size=(1920, 1080)) -> Image.Image:
+    # UI-like frame: flat panels, text-ish lines and one photo-like area
+    img = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(img)
+    width, height = size
+    draw.rectangle((0, 0, width, 48), fill=(45, 45, 48))
+    draw.rectangle((0, 48, 280, height), fill=(230, 230, 235))
+    for y in range(80, height - 40, 22):
+        x = 300
+        while x < width - 600:
+            word = rng.randint(20, 90)
+            draw.rectangle((x, y, x + word, y + 10), fill=(rng.randint(0, 80),) * 3)
+            x += word + 8
+    photo = Image.effect_noise((480, 320), 64).convert("RGB")
+    img.paste(photo, (width - 560, 120))
+    return img
+
+
+def make_frames(dir_path: str, count: int, extension: str = ".jpg", quality: int = 85, size=(1920, 1080),
+                seed: int = 0, mode: str = "RGB") -> list:
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        path = os.path.join(dir_path, f"{index:06d}{extension}")
+        img = make_frame(rng, size).convert(mode)
+        if extension == ".jpg":
+            img.save(path, quality=quality, optimize=True)
+        else:
+            img.save(path)
+        paths.append(path)
+    return paths
+
+
+def bench_hotkey(idle_time: float = 2.0, presses: int = 200):
+    backend = main.ReplayHotkeyBackend()
+    pressed_at = []
+    latencies = []
+    done = threading.Event()
+
+    def on_screenshot():
+        latencies.append(time.perf_counter() - pressed_at[-1])
+        done.set()
+
+    dispatcher = main.HotkeyDispatcher(backend)
+    dispatcher.bind("v", on_screenshot)
+    dispatcher.bind_long_press("Esc", lambda: None)
+    dispatcher.start()
+
+    # idle CPU: process time burned while no key is pressed
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    time.sleep(idle_time)
+    cpu_used, wall_used = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    for _ in range(presses):
+        done.clear()
+        pressed_at.append(time.perf_counter())
+        backend.press("v")
+        done.wait(1)
+        backend.release("v")
+    dispatcher.stop(1)
+
+    print(f"hotkey idle CPU: {cpu_used / wall_used * 100:.2f}% of one core over {wall_used:.1f}s")
+    print(f"hotkey latency ({len(latencies)} presses): "
+          f"median {format_ms(statistics.median(latencies))}, max {format_ms(max(latencies))}")
+
+
+def bench_export(count: int = 40):
+    for extension in (".jpg", ".png"):
+        with tempfile.TemporaryDirectory() as dir_path:
+            img_paths = make_frames(dir_path, count, extension)
+            for name, export in (("fpdf", main.save_img_paths_as_pdf_fpdf),
+                                 ("passthrough", main.save_img_paths_as_pdf)):
+                pdf_path = os.path.join(dir_path, f"{name}.pdf")
+                start = time.perf_counter()
+                export(img_paths, pdf_path)
+                used = time.perf_counter() - start
+                print(f"export {count} {extension} pages via {name}: {used:.2f}s "
+                      f"({count / used:.1f} pages/s), {os.path.getsize(pdf_path) / 1024 / 1024:.1f} MiB")
+
+
+def bench_parallel_export(count: int = 48):
+    # RGBA PNGs cannot be copied into the PDF, every page is decoded and compressed again
+    with tempfile.TemporaryDirectory() as dir_path:
+        img_paths = make_frames(dir_path, count, ".png", size=(2560, 1440), mode="RGBA")
+        worker_counts = sorted({1, 2, 4, main.export_worker_count()})
+        for workers in worker_counts:
+            pdf_path = os.path.join(dir_path, f"{workers}.pdf")
+            start = time.perf_counter()
+            main.save_img_paths_as_pdf(img_paths, pdf_path, workers=workers)
+            used = time.perf_counter() - start
+            print(f"export {count} RGBA .png pages with {workers} workers: {used:.2f}s ({count / used:.1f} pages/s)")
+
+
+def bench_grab(grabs: int = 30):
+    for name in main.screen_backends:
+        try:
+            screen = main.create_screen_backend(name)
+        except Exception as e:
+            print(f"grab via {name}: not available ({e})")
+            continue
+        left, top, width, height = screen.monitors()[0]
+        for region_name, region in (("full", None), ("quarter", (left, top, width // 2, height // 2))):
+            times = []
+            for _ in range(grabs):
+                start = time.perf_counter()
+                screen.grab(region)
+                times.append(time.perf_counter() - start)
+            print(f"grab via {name} ({region_name}): median {format_ms(statistics.median(times))}, "
+                  f"max {format_ms(max(times))}")
+        screen.close()
+
+
+def bench_auto_capture(idle_time: float = 10.0, threshold: float = 0.01):
+    # static screen: sampling backs off, idle CPU is the sampling cost
+    # moving screen: the synthetic box changes about 1.8% of the pixels per frame, over `threshold`
+    for name, screen in (("static", main.FakeScreenBackend(monitors=[(0, 0, 1920, 1080)])),
+                         ("moving", main.SyntheticScreenBackend(monitors=[(0, 0, 1920, 1080)]))):
+        captures = []
+        scheduler = main.AutoCaptureScheduler(grab=lambda: (screen.grab(), None),
+                                              capture=lambda: captures.append(time.time()), threshold=threshold)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        scheduler.start()
+        time.sleep(idle_time)
+        scheduler.stop(5)
+        cpu_used, wall_used = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        stats = scheduler.stats()
+        print(f"auto capture ({name} screen): {cpu_used / wall_used * 100:.2f}% of one core, "
+              f"{stats['sampled']} samples at {format_ms(stats['mean_sample_time'])}, {len(captures)} captures")
+        if name == "moving":
+            assert len(captures) > 1, f"the moving screen triggered {len(captures)} captures"
+        else:
+            assert len(captures) <= 1, f"the static screen triggered {len(captures)} captures"
+
+
+def dir_size(dir_path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(dir_path) if entry.is_file())
+
+
+def bench_tile_storage(count: int = 60, session: str = None):
+    # frames of a recorded session dir, or of a synthetic session
+    if session:
+        frames = [Image.open(os.path.join(session, name)).convert("RGB") for name in sorted(os.listdir(session))
+                  if name.endswith((".jpg", ".png"))]
+    else:
+        screen = main.SyntheticScreenBackend(monitors=[(0, 0, 1920, 1080)])
+        background = make_frame(random.Random(0))
+        screen.desktop.paste(background)
+        frames = [screen.grab() for _ in range(count)]
+    if not frames:
+        print("tile storage: no frames")
+        return
+    for extension in (".jpg", ".png"):
+        for name in ("disk", "tiles"):
+            with tempfile.TemporaryDirectory() as dir_path:
+                if name == "tiles":
+                    store = main.TileFrameStore(dir_path, extension)
+                else:
+                    store = main.DiskFrameStore(dir_path)
+                start = time.perf_counter()
+                for seq, img in enumerate(frames):
+                    if store.stores_images:
+                        store.put_image(seq, f"{seq:06d}{extension}", img)
+                    else:
+                        store.put(seq, f"{seq:06d}{extension}", main.encode_image(img, extension))
+                used = time.perf_counter() - start
+                size = dir_size(dir_path)
+                start = time.perf_counter()
+                main.save_img_paths_as_pdf(store.sources(), os.path.join(dir_path, "out.pdf"), workers=0)
+                export_used = time.perf_counter() - start
+                store.close()
+                print(f"store {len(frames)} {extension} frames as {name}: {format_ms(used / len(frames))} per frame, "
+                      f"{size / 1024 / 1024:.2f} MiB on disk, export {export_used:.2f}s")
+    # frames rebuilt from the tiles are the frames stored, also for edge tiles of the same bytes but another
+    # shape, captures of other sizes and modes, and after a resume
+    white = Image.new("RGB", (1000, 1000), "white")
+    edge_cases = [white, white.crop((0, 0, 744, 488)), white.convert("L"), Image.new("L", (1000, 1000), 255)]
+    with tempfile.TemporaryDirectory() as dir_path:
+        store = main.TileFrameStore(dir_path, ".png")
+        for seq, img in enumerate(frames[:4] + edge_cases[:2]):
+            store.put_image(seq, f"{seq:06d}.png", img)
+        store.close()
+        store = main.TileFrameStore(dir_path, ".png")
+        for seq, img in enumerate(edge_cases[2:], 6):
+            store.put_image(seq, f"{seq:06d}.png", img)
+        store.close()
+        stored = frames[:4] + edge_cases
+        rebuilt = main.TileFrameStore.load_frames(dir_path)
+        assert len(rebuilt) == len(stored)
+        for img, frame in zip(stored, rebuilt):
+            back = frame.image()
+            assert (back.mode, back.size) == (img.mode, img.size) and back.tobytes() == img.tobytes(), img
+    print(f"tile storage: {len(stored)} frames rebuilt from tiles as stored")
+
+
+export_memory_script = """
+import json, os, resource, sys
+sys.path.insert(0, {package_path!r})
+import main
+def peak_mb(who=resource.RUSAGE_SELF):
+    if who == resource.RUSAGE_SELF and os.path.exists("/proc/self/status"):
+        # ru_maxrss keeps the peak of the parent across exec on Linux, VmHWM starts again
+        with open("/proc/self/status") as file:
+            return int(next(line for line in file if line.startswith("VmHWM:")).split()[1]) / 1024
+    # KiB on Linux, bytes on macOS
+    return resource.getrusage(who).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+baseline = peak_mb()
+img_paths = json.load(open({list_path!r}))
+volumes = []
+pages = main.save_img_paths_as_pdf(img_paths, {pdf_path!r}, workers={workers!r}, max_pages={max_pages!r},
+                                   volumes=volumes)
+print(json.dumps(dict(pages=pages, volumes=len(volumes), baseline=baseline, peak=peak_mb(),
+                      workers_peak=peak_mb(resource.RUSAGE_CHILDREN))))
+"""
+
+
+def make_4k_frames(dir_path: str, count: int) -> list:
+    # one UI-like base, every frame gets a different noisy patch so no two images are the same
+    rng = random.Random(0)
+    base = make_frame(rng, (3840, 2160))
+    patch = Image.effect_noise((256, 256), 64).convert("RGB")
+    paths = []
+    for index in range(count):
+        img = base.copy()
+        img.paste(patch, (rng.randrange(0, 3840 - 256), rng.randrange(48, 2160 - 256)))
+        ImageDraw.Draw(img).text((300, 60), f"frame {index}", fill=(0, 0, 0))
+        path = os.path.join(dir_path, f"{index:06d}.jpg")
+        img.save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def bench_export_memory(count: int = 2000, budget_mb: float = 256, max_pages: int = 500):
+    """Export thousands of 4K frames in a fresh process and check its peak RSS stays within the budget."""
+    try:
+        import resource
+    except ImportError:
+        print("export memory: not available (no resource module)")
+        return
+    package_path = os.path.dirname(os.path.abspath(main.__file__))
+    with tempfile.TemporaryDirectory() as dir_path:
+        start = time.perf_counter()
+        img_paths = make_4k_frames(dir_path, count)
+        print(f"export memory: {count} 4K frames made in {time.perf_counter() - start:.1f}s, "
+              f"{dir_size(dir_path) / 1024 / 1024:.0f} MiB")
+        list_path = os.path.join(dir_path, "frames.json")
+        with open(list_path, "w") as file:
+            json.dump(img_paths, file)
+        failed = []
+        for workers in (1, 2):
+            pdf_path = os.path.join(dir_path, f"out_{workers}.pdf")
+            script = export_memory_script.format(package_path=package_path, list_path=list_path, pdf_path=pdf_path,
+                                                 workers=workers, max_pages=max_pages)
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+            used = time.perf_counter() - start
+            if result.returncode != 0:
+                print(result.stderr)
+                failed.append(f"{workers} workers: exit code {result.returncode}")
+                continue
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            growth = stats["peak"] - stats["baseline"]
+            print(f"export memory ({workers} workers): {stats['pages']} pages in {stats['volumes']} volumes, "
+                  f"{used:.1f}s, peak RSS {stats['peak']:.0f} MiB ({growth:+.0f} MiB over import), "
+                  f"worker peak RSS {stats['workers_peak']:.0f} MiB")
+            if stats["pages"] != count:
+                failed.append(f"{workers} workers: {stats['pages']} of {count} pages")
+            if growth > budget_mb or stats["workers_peak"] > budget_mb:
+                failed.append(f"{workers} workers: RSS over the {budget_mb} MiB budget")
+            for name in os.listdir(dir_path):
+                if name.startswith(f"out_{workers}"):
+                    os.remove(os.path.join(dir_path, name))
+        assert not failed, "; ".join(failed)
+
+
+def bench_export_scale(count: int = 24):
+    # 4K screenshots of a 200% display, exported at native size and downscaled, then again from the cache
+    settings = (("native", main.ExportScale()),
+                ("max 1920x1080", main.ExportScale(max_width=1920, max_height=1080)),
+                ("96 dpi", main.ExportScale(dpi=96, screen_dpi=192)),
+                ("72 dpi", main.ExportScale(dpi=72, screen_dpi=192)))
+    with tempfile.TemporaryDirectory() as dir_path:
+        make_frames(dir_path, count, ".jpg", size=(3840, 2160))
+        for name, scale in settings:
+            # settings with the same pixel size would share the cache
+            shutil.rmtree(os.path.join(dir_path, main.ExportScale.cache_name), ignore_errors=True)
+            times = []
+            for _ in range(2):
+                pdf_path = os.path.join(dir_path, "out.pdf")
+                start = time.perf_counter()
+                main.save_session_as_pdf(dir_path, pdf_path, workers=0, scale=scale)
+                times.append(time.perf_counter() - start)
+            print(f"export {count} 4K pages at {name}: {times[0]:.2f}s, cached {times[1]:.2f}s, "
+                  f"{os.path.getsize(pdf_path) / 1024 / 1024:.1f} MiB")
+
+
+def make_photo_frame(size=(1920, 1080)) -> Image.Image:
+    # video or photo content: smooth gradients with noise
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 24)
+    return Image.merge("RGB", (gradient, Image.blend(gradient, noise, 0.5), noise))
+
+
+def bench_frame_encoding(count: int = 8):
+    # size and encode time per frame, one format by img_quality against the choice by content
+    rng = random.Random(0)
+    kinds = (("ui", [make_frame(rng) for _ in range(count)]),
+             ("text", [make_frame(rng).crop((300, 60, 1300, 1060)).resize((1920, 1080)) for _ in range(count)]),
+             ("photo", [make_photo_frame() for _ in range(count)]))
+    for kind, frames in kinds:
+        for img_format in ("quality", "auto"):
+            sizes, times, encodings = [], [], []
+            for img in frames:
+                start = time.perf_counter()
+                if img_format == "auto":
+                    data, _, encoding = main.encode_image_auto(img, 85)
+                    encodings.append(encoding)
+                else:
+                    data = main.encode_image(img, ".jpg", 85)
+                times.append(time.perf_counter() - start)
+                sizes.append(len(data))
+            print(f"encode {kind} frames by {img_format}: {statistics.mean(sizes) / 1024:.0f} KiB, "
+                  f"{format_ms(statistics.median(times))}"
+                  + (f", {', '.join(sorted(set(encodings)))}" if encodings else ""))
+    # every mode a screenshot may come in decodes back to its pixels, unless it went to JPEG
+    flat_ui = Image.new("RGB", (640, 360), (240, 240, 240))
+    ImageDraw.Draw(flat_ui).rectangle((40, 40, 300, 200), fill=(0, 120, 215))
+    rgba = make_frame(rng, (640, 360)).convert("RGBA")
+    rgba.putalpha(Image.linear_gradient("L").resize((640, 360)))
+    for mode, img in (("RGB", flat_ui), ("RGB", make_frame(rng, (640, 360))), ("RGBA", rgba),
+                      ("RGBA", flat_ui.convert("RGBA")), ("L", flat_ui.convert("L")),
+                      ("L", make_photo_frame().convert("L")),
+                      ("P", flat_ui.quantize(8)), ("P", make_frame(rng, (640, 360)).quantize(256))):
+        data, extension, encoding = main.encode_image_auto(img, 85)
+        with Image.open(io.BytesIO(data)) as back:
+            assert back.size == img.size, (mode, encoding)
+            if encoding != "jpeg":
+                assert list(back.convert("RGBA").getdata()) == list(img.convert("RGBA").getdata()), (mode, encoding)
+        print(f"encode {mode} frame: {encoding} {extension}, {len(data) / 1024:.0f} KiB, decodes back")
+
+
+def bench_border_crop(count: int = 40):
+    # the crop pass decodes every frame once more, its memory stays at a few frames whatever the count
+    import tracemalloc
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as dir_path:
+        # a window in the middle of a static desktop with a taskbar
+        desktop = Image.linear_gradient("L").resize((1920, 1080)).convert("RGB")
+        ImageDraw.Draw(desktop).rectangle((0, 1040, 1920, 1080), fill=(20, 20, 24))
+        img_paths = []
+        for index in range(count):
+            img = desktop.copy()
+            img.paste(make_frame(rng, (1280, 720)), (320, 160))
+            img_paths.append(os.path.join(dir_path, f"{index:06d}.jpg"))
+            img.save(img_paths[-1], quality=85, optimize=True)
+        for crop in (None, main.BorderCrop()):
+            pdf_path = os.path.join(dir_path, "out.pdf")
+            tracemalloc.start()
+            start = time.perf_counter()
+            main.save_img_paths_as_pdf(img_paths, pdf_path, workers=0, crop=crop)
+            used = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"export {count} pages {'with' if crop else 'without'} border crop: {used:.2f}s, "
+                  f"{os.path.getsize(pdf_path) / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.0f} MiB traced")
+
+
+startup_script = """
+import os, sys, time
+sys.path.insert(0, {package_path!r})
+from PyQt5.QtWidgets import QApplication
+import main
+main.app = QApplication(sys.argv)
+main.main = main.Main()
+main.app.processEvents()
+print(time.time() - {start!r})
+"""
+
+
+def bench_startup(runs: int = 5):
+    # time from process start to the first window, on a fresh data dir and with the theme cache filled
+    package_path = os.path.dirname(os.path.abspath(main.__file__))
+    with tempfile.TemporaryDirectory() as work_dir_path:
+        times = []
+        for _ in range(runs):
+            script = startup_script.format(package_path=package_path, start=time.time())
+            result = subprocess.run([sys.executable, "-c", script], cwd=work_dir_path, capture_output=True, text=True)
+            times.append(float(result.stdout.strip().splitlines()[-1]))
+        print(f"startup to first window: first run {format_ms(times[0])}, "
+              f"cached median {format_ms(statistics.median(times[1:]))}")
+
+
+benchmarks = {
+    "hotkey": bench_hotkey,
+    "export": bench_export,
+    "parallel_export": bench_parallel_export,
+    "grab": bench_grab,
+    "auto_capture": bench_auto_capture,
+    "tile_storage": bench_tile_storage,
+    "startup": bench_startup,
+    "export_memory": bench_export_memory,
+    "export_scale": bench_export_scale,
+    "frame_encoding": bench_frame_encoding,
+    "border_crop": bench_border_crop,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f"{main.NAME} benchmarks")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run ({', '.join(benchmarks)}), default all")
+    parser.add_argument("--session", help="session dir of screenshots to replay in tile_storage")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in benchmarks:
+            parser.error(f"unknown benchmark \"{name}\"")
+    for name in args.names or benchmarks:
+        if name == "tile_storage":
+            benchmarks[name](session=args.session)
+        else:
+            benchmarks[name]()
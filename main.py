@@ -1,39 +1,44 @@
 import ctypes
+import hashlib
+import io
 import json
+import logging
+import logging.handlers
+import multiprocessing
 import os
-import shutil
 import sys
 import threading
 import time
 import traceback
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from queue import Queue
+from queue import Empty, Full, Queue
 from typing import Callable, Any
 
-import keyboard
-import pyautogui
+import numpy as np
 from PIL import Image
 from PyQt5 import Qt as pyqt5Qt
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QKeySequence, QTextCursor, QIcon
-from PyQt5.QtWidgets import QApplication, QCheckBox, QDialog, QDesktopWidget, QFileDialog, QHBoxLayout, \
-    QKeySequenceEdit, QLabel, QLineEdit, QMessageBox, QPushButton, QSlider, QTextEdit, QVBoxLayout, QWidget
-from fpdf import FPDF
-from plyer import notification
+from PyQt5.QtCore import QDir, QRect, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QFontDatabase, QGuiApplication, QKeySequence, QPalette, QTextCursor, QIcon
+from PyQt5.QtWidgets import QApplication, QCheckBox, QComboBox, QDialog, QDesktopWidget, QFileDialog, QHBoxLayout, \
+    QKeySequenceEdit, QLabel, QLineEdit, QMessageBox, QPushButton, QRubberBand, QSlider, QTextEdit, QVBoxLayout, \
+    QWidget
 
 if sys.platform == "win32":
     # 修复PyQt5任务栏图标
     ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID("myappid")
 
-# qt_material must import after PyQt5
-import qt_material
-
 __version__ = 'v0.6'
 
 CURRENT_PATH = os.path.abspath(__file__)
 WORKDIR = os.getcwd()
 DATA_DIR = os.path.join(WORKDIR, "data")
 CONFIG_DIR = os.path.join(DATA_DIR, "config")
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+LOG_DIR = os.path.join(DATA_DIR, "log")
+THEME_CACHE_DIR = os.path.join(CONFIG_DIR, "theme")
 ICON_PATH = r".\QScreenCatcherIcon.ico"
 NAME = "QScreenCatcher"
 intro = f"Welcome to use {NAME} {__version__}\n欢迎使用{NAME} {__version__}"
@@ -116,6 +121,2400 @@ class PushButton(QPushButton):
         super().setText(text)
 
 
+class HotkeyEvent:
+    KEY_DOWN = "down"
+    KEY_UP = "up"
+
+    def __init__(self, name: str, event_type: str, event_time: float = None):
+        self.name = name
+        self.event_type = event_type
+        self.time = time.time() if event_time is None else event_time
+
+    def __repr__(self):
+        return f"HotkeyEvent({self.name!r}, {self.event_type!r})"
+
+
+class HotkeyBackend:
+    """Source of key events for HotkeyDispatcher."""
+
+    def hook(self, callback: Callable[[HotkeyEvent], Any]) -> None:
+        raise NotImplementedError
+
+    def unhook(self) -> None:
+        raise NotImplementedError
+
+
+class KeyboardHotkeyBackend(HotkeyBackend):
+    """Global key hook of the `keyboard` module, events arrive without any polling."""
+
+    def __init__(self):
+        self.hook_handle = None
+
+    def hook(self, callback: Callable[[HotkeyEvent], Any]) -> None:
+        def on_keyboard_event(event):
+            callback(HotkeyEvent(event.name or "", event.event_type, event.time))
+
+        import keyboard
+        self.hook_handle = keyboard.hook(on_keyboard_event)
+
+    def unhook(self) -> None:
+        if self.hook_handle is not None:
+            import keyboard
+            keyboard.unhook(self.hook_handle)
+            self.hook_handle = None
+
+
+class ReplayHotkeyBackend(HotkeyBackend):
+    """Feed synthetic key events to the dispatcher, for tests and benchmarks."""
+
+    def __init__(self):
+        self.callback = None
+
+    def hook(self, callback: Callable[[HotkeyEvent], Any]) -> None:
+        self.callback = callback
+
+    def unhook(self) -> None:
+        self.callback = None
+
+    def send(self, name: str, event_type: str) -> bool:
+        if self.callback is None:
+            return False
+        self.callback(HotkeyEvent(name, event_type))
+        return True
+
+    def press(self, name: str) -> bool:
+        return self.send(name, HotkeyEvent.KEY_DOWN)
+
+    def release(self, name: str) -> bool:
+        return self.send(name, HotkeyEvent.KEY_UP)
+
+    def tap(self, name: str) -> bool:
+        return self.press(name) and self.release(name)
+
+    def replay(self, events: list, speed: float = 1.0):
+        # events: [(delay_seconds, name, event_type), ...]
+        for delay, name, event_type in events:
+            if delay > 0:
+                time.sleep(delay / speed)
+            self.send(name, event_type)
+
+
+class HotkeyDispatcher:
+    key_aliases = {
+        "control": "ctrl",
+        "escape": "esc",
+        "return": "enter",
+        "del": "delete",
+        "ins": "insert",
+        "pgup": "page up",
+        "pgdown": "page down",
+        "meta": "windows",
+        "win": "windows",
+    }
+
+    class Binding:
+        def __init__(self, keys: frozenset, callback: Callable, press_time: float = 0, with_time: bool = False):
+            self.keys = keys
+            self.callback = callback
+            self.press_time = press_time
+            # pass the time of the key event to the callback
+            self.with_time = with_time
+            self.active = False
+            self.timer: (threading.Timer, None) = None
+
+    def __init__(self, backend: HotkeyBackend = None):
+        if backend is None:
+            backend = KeyboardHotkeyBackend()
+        self.backend = backend
+        self.bindings: list[HotkeyDispatcher.Binding] = []
+        self.pressed_keys: set[str] = set()
+        self.lock = threading.Lock()
+        self.callback_queue = Queue()
+        self.worker: (threading.Thread, None) = None
+        self.running = False
+
+    @classmethod
+    def normalize_key_name(cls, name: str) -> str:
+        name = name.strip().lower()
+        for side in ("left ", "right "):
+            if name.startswith(side) and len(name) > len(side):
+                name = name[len(side):]
+        return cls.key_aliases.get(name, name)
+
+    @classmethod
+    def parse_hotkey(cls, hotkey: str) -> frozenset:
+        # "Ctrl+Shift+V" -> {"ctrl", "shift", "v"}, "Ctrl++" -> {"ctrl", "+"}
+        hotkey = hotkey.strip()
+        if hotkey.endswith("++"):
+            parts = hotkey[:-2].split("+") + ["+"]
+        elif hotkey == "+":
+            parts = ["+"]
+        else:
+            parts = hotkey.split("+")
+        keys = frozenset(cls.normalize_key_name(part) for part in parts if part.strip())
+        if not keys:
+            raise ValueError(f"Hotkey\"{hotkey}\" is empty")
+        return keys
+
+    def bind(self, hotkey: str, callback: Callable, with_time: bool = False):
+        """Call `callback` once every time `hotkey` goes down, as `callback(event_time)` if `with_time`."""
+        self.bindings.append(self.Binding(self.parse_hotkey(hotkey), callback, with_time=with_time))
+
+    def bind_long_press(self, hotkey: str, callback: Callable, press_time: float = 1):
+        """Call `callback` once `hotkey` has been held down for `press_time` seconds."""
+        self.bindings.append(self.Binding(self.parse_hotkey(hotkey), callback, press_time=press_time))
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.pressed_keys.clear()
+        self.callback_queue = Queue()
+        self.worker = threading.Thread(target=self.run_callbacks, daemon=True)
+        self.worker.start()
+        self.backend.hook(self.on_event)
+
+    def stop(self, timeout: float = None):
+        if not self.running:
+            return
+        self.running = False
+        self.backend.unhook()
+        with self.lock:
+            for binding in self.bindings:
+                self.deactivate(binding)
+            self.pressed_keys.clear()
+        # callbacks already queued (e.g. screenshots) still run before the worker quits
+        self.callback_queue.put(None)
+        if self.worker is not None and self.worker is not threading.current_thread():
+            self.worker.join(timeout)
+
+    def on_event(self, event: HotkeyEvent):
+        if not self.running:
+            return
+        name = self.normalize_key_name(event.name)
+        with self.lock:
+            if event.event_type == HotkeyEvent.KEY_DOWN:
+                if name in self.pressed_keys:
+                    # auto-repeat of a held key
+                    return
+                self.pressed_keys.add(name)
+                for binding in self.bindings:
+                    if binding.active or not binding.keys <= self.pressed_keys:
+                        continue
+                    binding.active = True
+                    if binding.press_time > 0:
+                        binding.timer = threading.Timer(binding.press_time, self.on_long_press, args=(binding,))
+                        binding.timer.daemon = True
+                        binding.timer.start()
+                    else:
+                        self.callback_queue.put((binding, event.time))
+            elif event.event_type == HotkeyEvent.KEY_UP:
+                self.pressed_keys.discard(name)
+                for binding in self.bindings:
+                    if binding.active and name in binding.keys:
+                        self.deactivate(binding)
+
+    @staticmethod
+    def deactivate(binding: Binding):
+        binding.active = False
+        if binding.timer is not None:
+            binding.timer.cancel()
+            binding.timer = None
+
+    def on_long_press(self, binding: Binding):
+        with self.lock:
+            if not self.running or not binding.active or binding.timer is None:
+                return
+            binding.timer = None
+            self.callback_queue.put((binding, time.time()))
+
+    def run_callbacks(self):
+        while True:
+            item = self.callback_queue.get()
+            if item is None:
+                return
+            binding, event_time = item
+            try:
+                if binding.with_time:
+                    binding.callback(event_time)
+                else:
+                    binding.callback()
+            except Exception:
+                output(traceback.format_exc())
+
+
+def intersect_rect(rect_a: tuple, rect_b: tuple) -> (tuple, None):
+    # rects are (left, top, width, height)
+    left = max(rect_a[0], rect_b[0])
+    top = max(rect_a[1], rect_b[1])
+    right = min(rect_a[0] + rect_a[2], rect_b[0] + rect_b[2])
+    bottom = min(rect_a[1] + rect_a[3], rect_b[1] + rect_b[3])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def union_rect(rects: list) -> tuple:
+    left = min(rect[0] for rect in rects)
+    top = min(rect[1] for rect in rects)
+    right = max(rect[0] + rect[2] for rect in rects)
+    bottom = max(rect[1] + rect[3] for rect in rects)
+    return left, top, right - left, bottom - top
+
+
+class ScreenBackend:
+    """Where screenshots come from. Rects are (left, top, width, height) in physical pixels."""
+
+    def monitors(self) -> list:
+        raise NotImplementedError
+
+    def active_window_rect(self) -> (tuple, None):
+        return None
+
+    def grab(self, region: tuple = None) -> Image.Image:
+        """Grab `region` of the virtual desktop, the primary screen if None."""
+        raise NotImplementedError
+
+    def desktop_rect(self) -> tuple:
+        return union_rect(self.monitors())
+
+    def close(self):
+        pass
+
+
+class PyAutoGUIScreenBackend(ScreenBackend):
+    def monitors(self) -> list:
+        if sys.platform == "win32":
+            return self.win32_monitors()
+        app_instance = QApplication.instance()
+        if app_instance is not None:
+            monitors = []
+            for screen in app_instance.screens():
+                geometry, ratio = screen.geometry(), screen.devicePixelRatio()
+                monitors.append((round(geometry.x() * ratio), round(geometry.y() * ratio),
+                                 round(geometry.width() * ratio), round(geometry.height() * ratio)))
+            if monitors:
+                return monitors
+        import pyautogui
+        width, height = pyautogui.size()
+        return [(0, 0, width, height)]
+
+    @staticmethod
+    def win32_monitors() -> list:
+        from ctypes import wintypes
+        monitors = []
+        monitor_enum_proc = ctypes.WINFUNCTYPE(ctypes.c_int, wintypes.HMONITOR, wintypes.HDC,
+                                               ctypes.POINTER(wintypes.RECT), wintypes.LPARAM)
+
+        def on_monitor(_monitor, _dc, rect, _data):
+            rect = rect.contents
+            monitors.append((rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top))
+            return 1
+
+        ctypes.windll.user32.EnumDisplayMonitors(None, None, monitor_enum_proc(on_monitor), 0)
+        return monitors
+
+    def active_window_rect(self) -> (tuple, None):
+        try:
+            if sys.platform == "win32":
+                return self.win32_active_window_rect()
+            return self.x11_active_window_rect()
+        except Exception:
+            return None
+
+    @staticmethod
+    def win32_active_window_rect() -> (tuple, None):
+        from ctypes import wintypes
+        hwnd = ctypes.windll.user32.GetForegroundWindow()
+        if not hwnd:
+            return None
+        rect = wintypes.RECT()
+        # DWMWA_EXTENDED_FRAME_BOUNDS excludes the invisible resize borders
+        if ctypes.windll.dwmapi.DwmGetWindowAttribute(hwnd, 9, ctypes.byref(rect), ctypes.sizeof(rect)) != 0:
+            ctypes.windll.user32.GetWindowRect(hwnd, ctypes.byref(rect))
+        return rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top
+
+    @staticmethod
+    def x11_active_window_rect() -> (tuple, None):
+        # python-xlib comes with pyautogui on Linux
+        from Xlib import X, display as xdisplay
+        x_display = xdisplay.Display()
+        try:
+            root = x_display.screen().root
+            active = root.get_full_property(x_display.intern_atom("_NET_ACTIVE_WINDOW"), X.AnyPropertyType)
+            if active is None or not active.value or not active.value[0]:
+                return None
+            window = x_display.create_resource_object("window", active.value[0])
+            geometry = window.get_geometry()
+            position = window.translate_coords(root, 0, 0)
+            return -position.x, -position.y, geometry.width, geometry.height
+        finally:
+            x_display.close()
+
+    def grab(self, region: tuple = None) -> Image.Image:
+        # pyautogui needs a display, imported on first grab so exports run headless
+        import pyautogui
+        if region is None:
+            return pyautogui.screenshot()
+        if sys.platform == "win32":
+            # monitors left of or above the primary one have negative coordinates
+            from PIL import ImageGrab
+            left, top, width, height = region
+            return ImageGrab.grab(bbox=(left, top, left + width, top + height), all_screens=True)
+        return pyautogui.screenshot(region=tuple(region))
+
+
+class FakeScreenBackend(ScreenBackend):
+    """Headless screen made of a static picture, records every grabbed region."""
+
+    def __init__(self, monitors: list = None, active_window: tuple = None):
+        if monitors is None:
+            monitors = [(0, 0, 1920, 1080)]
+        self.fake_monitors = [tuple(monitor) for monitor in monitors]
+        self.fake_active_window = active_window
+        self.grabbed_regions = []
+        left, top, width, height = self.desktop_rect()
+        self.origin = (left, top)
+        self.desktop = Image.new("RGB", (width, height), (0, 0, 0))
+        for index, monitor in enumerate(self.fake_monitors):
+            color = ((80 * index + 40) % 256, (50 * index + 90) % 256, (30 * index + 140) % 256)
+            self.desktop.paste(color, self.to_box(monitor))
+
+    def to_box(self, rect: tuple) -> tuple:
+        left, top, width, height = rect
+        return left - self.origin[0], top - self.origin[1], left - self.origin[0] + width, top - self.origin[1] + height
+
+    def monitors(self) -> list:
+        return list(self.fake_monitors)
+
+    def active_window_rect(self) -> (tuple, None):
+        return self.fake_active_window
+
+    def grab(self, region: tuple = None) -> Image.Image:
+        if region is None:
+            region = self.fake_monitors[0]
+        self.grabbed_regions.append(tuple(region))
+        return self.desktop.crop(self.to_box(region))
+
+
+class SyntheticScreenBackend(FakeScreenBackend):
+    """Deterministic moving frames for tests and benchmarks, frame n is the same for the same seed."""
+
+    def __init__(self, monitors: list = None, active_window: tuple = None, seed: int = 0):
+        super().__init__(monitors=monitors, active_window=active_window)
+        self.seed = seed
+        self.frame_index = 0
+        self.lock = threading.Lock()
+
+    def render(self, index: int) -> Image.Image:
+        from PIL import ImageDraw
+        desktop = self.desktop.copy()
+        draw = ImageDraw.Draw(desktop)
+        width, height = desktop.size
+        # a box crossing the desktop and a status line, like a cursor moving over a UI
+        box_size = max(16, min(width, height) // 8)
+        box_left = (self.seed * 97 + index * 37) % max(1, width - box_size)
+        box_top = (self.seed * 61 + index * 23) % max(1, height - box_size)
+        draw.rectangle((box_left, box_top, box_left + box_size, box_top + box_size), fill=(230, 230, 230))
+        draw.text((8, height - 24), f"{NAME} synthetic frame {index}", fill=(255, 255, 255))
+        return desktop
+
+    def grab(self, region: tuple = None) -> Image.Image:
+        if region is None:
+            region = self.fake_monitors[0]
+        with self.lock:
+            index = self.frame_index
+            self.frame_index += 1
+            self.grabbed_regions.append(tuple(region))
+        return self.render(index).crop(self.to_box(region))
+
+
+class XShmScreenBackend(PyAutoGUIScreenBackend):
+    """
+    X11 grabs through the MIT-SHM extension: the X server copies pixels straight into one shared memory
+    segment which is reused for every frame of the same size.
+    """
+
+    class XImage(ctypes.Structure):
+        # leading fields of Xlib's XImage
+        _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int),
+                    ("format", ctypes.c_int), ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                    ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int), ("bitmap_pad", ctypes.c_int),
+                    ("depth", ctypes.c_int), ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int),
+                    ("red_mask", ctypes.c_ulong), ("green_mask", ctypes.c_ulong), ("blue_mask", ctypes.c_ulong)]
+
+    class XShmSegmentInfo(ctypes.Structure):
+        _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int), ("shmaddr", ctypes.c_void_p),
+                    ("readOnly", ctypes.c_int)]
+
+    ZPixmap = 2
+    IPC_PRIVATE = 0
+    IPC_CREAT = 0o1000
+    IPC_RMID = 0
+    AllPlanes = 0xFFFFFFFF
+
+    def __init__(self):
+        import ctypes.util
+        if sys.platform == "win32":
+            raise OSError("XShm is only available on X11")
+        libraries = {name: ctypes.util.find_library(name) for name in ("X11", "Xext", "c")}
+        for name, path in libraries.items():
+            if path is None:
+                raise OSError(f"lib{name} no found")
+        self.xlib = ctypes.CDLL(libraries["X11"])
+        self.xext = ctypes.CDLL(libraries["Xext"])
+        self.libc = ctypes.CDLL(libraries["c"], use_errno=True)
+        self.set_signatures()
+        self.display = self.xlib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("Cannot open the X display")
+        if not self.xext.XShmQueryExtension(self.display):
+            self.xlib.XCloseDisplay(self.display)
+            raise OSError("X server without MIT-SHM")
+        screen = self.xlib.XDefaultScreen(self.display)
+        self.root = self.xlib.XRootWindow(self.display, screen)
+        self.visual = self.xlib.XDefaultVisual(self.display, screen)
+        self.depth = self.xlib.XDefaultDepth(self.display, screen)
+        self.screen_size = (self.xlib.XDisplayWidth(self.display, screen),
+                            self.xlib.XDisplayHeight(self.display, screen))
+        self.image = None
+        self.image_size = None
+        self.shm_info = self.XShmSegmentInfo()
+        self.lock = threading.Lock()
+
+    def set_signatures(self):
+        xlib, xext, libc = self.xlib, self.xext, self.libc
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        xlib.XRootWindow.restype = ctypes.c_ulong
+        xlib.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultVisual.restype = ctypes.c_void_p
+        xlib.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDestroyImage.argtypes = [ctypes.POINTER(self.XImage)]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(self.XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_char_p, ctypes.POINTER(self.XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(self.XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(self.XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(self.XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def attach_image(self, width: int, height: int):
+        if self.image_size == (width, height):
+            return
+        self.detach_image()
+        image = self.xext.XShmCreateImage(self.display, self.visual, self.depth, self.ZPixmap, None,
+                                          ctypes.byref(self.shm_info), width, height)
+        if not image:
+            raise OSError("XShmCreateImage failed")
+        size = image.contents.bytes_per_line * height
+        shmid = self.libc.shmget(self.IPC_PRIVATE, size, self.IPC_CREAT | 0o600)
+        if shmid < 0:
+            self.xlib.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        shmaddr = self.libc.shmat(shmid, None, 0)
+        if shmaddr in (None, ctypes.c_void_p(-1).value):
+            self.libc.shmctl(shmid, self.IPC_RMID, None)
+            self.xlib.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        self.shm_info.shmid = shmid
+        self.shm_info.shmaddr = shmaddr
+        self.shm_info.readOnly = 0
+        image.contents.data = shmaddr
+        self.xext.XShmAttach(self.display, ctypes.byref(self.shm_info))
+        self.xlib.XSync(self.display, 0)
+        # the segment is freed once both sides detached
+        self.libc.shmctl(shmid, self.IPC_RMID, None)
+        self.image = image
+        self.image_size = (width, height)
+
+    def detach_image(self):
+        if self.image is None:
+            return
+        self.xext.XShmDetach(self.display, ctypes.byref(self.shm_info))
+        self.xlib.XDestroyImage(self.image)
+        self.libc.shmdt(self.shm_info.shmaddr)
+        self.image = None
+        self.image_size = None
+
+    def monitors(self) -> list:
+        if QApplication.instance() is not None:
+            return super().monitors()
+        return [(0, 0, *self.screen_size)]
+
+    def grab(self, region: tuple = None) -> Image.Image:
+        if region is None:
+            region = (0, 0, *self.screen_size)
+        left, top, width, height = region
+        with self.lock:
+            self.attach_image(width, height)
+            if not self.xext.XShmGetImage(self.display, self.root, self.image, left, top, self.AllPlanes):
+                raise OSError(f"XShmGetImage of {tuple(region)} failed")
+            image = self.image.contents
+            buffer = (ctypes.c_char * (image.bytes_per_line * height)).from_address(image.data)
+            # decoding BGRX copies the pixels out of the shared segment
+            return Image.frombuffer("RGB", (width, height), buffer, "raw", "BGRX", image.bytes_per_line, 1)
+
+    def close(self):
+        with self.lock:
+            self.detach_image()
+            if self.display:
+                self.xlib.XCloseDisplay(self.display)
+                self.display = None
+
+
+screen_backends = {
+    "pyautogui": PyAutoGUIScreenBackend,
+    "xshm": XShmScreenBackend,
+    "synthetic": SyntheticScreenBackend,
+}
+
+
+def create_screen_backend(name: str = "auto") -> ScreenBackend:
+    """Create a screen backend by name, "auto" prefers XShm on X11 and falls back to pyautogui."""
+    if name == "auto":
+        if sys.platform != "win32" and sys.platform != "darwin" and os.environ.get("DISPLAY"):
+            try:
+                return XShmScreenBackend()
+            except Exception:
+                output(f"Warning: XShm grab not available, use pyautogui\n{traceback.format_exc()}")
+        return PyAutoGUIScreenBackend()
+    if name not in screen_backends:
+        raise ValueError(f"Screen backend\"{name}\" no found")
+    return screen_backends[name]()
+
+
+class PreCaptureBuffer:
+    """
+    Grab frames continuously into a ring of raw frames, so a hotkey press can take the frame shown at the
+    moment of the press instead of grabbing after it. The ring holds at most `max_frames` frames and
+    `max_bytes` bytes of pixels, grabbing is capped at `fps` frames per second.
+    """
+
+    def __init__(self, grab: Callable[[], tuple], fps: float = 4, max_frames: int = 8,
+                 max_bytes: int = 256 * 1024 * 1024):
+        # grab() -> (image, region)
+        self.grab = grab
+        self.interval = 1 / max(0.1, fps)
+        self.max_frames = max(1, max_frames)
+        self.max_bytes = max_bytes
+        self.frames = deque()  # (timestamp, image, region)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: (threading.Thread, None) = None
+        self.grabbed = 0
+        self.taken = 0
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = None):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        with self.lock:
+            self.frames.clear()
+
+    def run(self):
+        next_grab = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                start = time.time()
+                img, region = self.grab()
+                timestamp = (start + time.time()) / 2
+                frame_bytes = img.width * img.height * len(img.getbands())
+                capacity = max(1, min(self.max_frames, self.max_bytes // max(1, frame_bytes)))
+                with self.lock:
+                    self.frames.append((timestamp, img, region))
+                    while len(self.frames) > capacity:
+                        self.frames.popleft()
+                    self.grabbed += 1
+            except Exception:
+                output(traceback.format_exc())
+            next_grab += self.interval
+            now = time.monotonic()
+            if next_grab < now:
+                # grabbing is slower than the rate, do not try to catch up
+                next_grab = now
+            self.stop_event.wait(next_grab - now)
+
+    def take(self, timestamp: float) -> (tuple, None):
+        """Return (image, region, frame_time) of the frame closest to `timestamp`, None if no frame yet."""
+        with self.lock:
+            if not self.frames:
+                return None
+            frame_time, img, region = min(self.frames, key=lambda frame: abs(frame[0] - timestamp))
+            self.taken += 1
+        return img, region, frame_time
+
+
+def sample_image(img: Image.Image, max_width: int = 256) -> np.ndarray:
+    """Small grayscale copy of `img` for cheap change detection."""
+    factor = max(1, img.width // max_width)
+    if factor > 1:
+        img = img.reduce(factor)
+    return np.asarray(img.convert("L"), dtype=np.int16)
+
+
+def changed_fraction(sample: np.ndarray, reference: np.ndarray, pixel_threshold: int = 16) -> float:
+    """Fraction of sample pixels differing from `reference` by more than `pixel_threshold` levels."""
+    if reference is None or sample.shape != reference.shape:
+        return 1.0
+    return np.count_nonzero(np.abs(sample - reference) > pixel_threshold) / sample.size
+
+
+class AutoCaptureScheduler:
+    """
+    Take screenshots without a key press: sample the screen at a low resolution and call `capture()` when
+    the changed fraction of pixels since the last capture reaches `threshold`. Captures are at least
+    `min_interval` seconds apart, and one is taken every `max_interval` seconds anyway (0: never).
+    While the screen does not change, sampling slows down to `max_sample_interval`.
+    """
+
+    def __init__(self, grab: Callable[[], tuple], capture: Callable[[], Any], threshold: float = 0.02,
+                 min_interval: float = 2, max_interval: float = 0, sample_interval: float = 0.5,
+                 max_sample_interval: float = 2, pixel_threshold: int = 16):
+        # grab() -> (image, region)
+        self.grab = grab
+        self.capture = capture
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.sample_interval = max(0.05, sample_interval)
+        self.max_sample_interval = max(self.sample_interval, max_sample_interval)
+        self.pixel_threshold = pixel_threshold
+        self.stop_event = threading.Event()
+        self.thread: (threading.Thread, None) = None
+        self.sampled = 0
+        self.captured = 0
+        self.sample_time = 0.0
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = None):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        captured_sample = None
+        last_sample = None
+        last_capture = None
+        interval = self.sample_interval
+        while not self.stop_event.is_set():
+            try:
+                start = time.perf_counter()
+                img, _ = self.grab()
+                sample = sample_image(img)
+                del img
+                self.sample_time += time.perf_counter() - start
+                self.sampled += 1
+                now = time.monotonic()
+                since_capture = None if last_capture is None else now - last_capture
+                changed = changed_fraction(sample, captured_sample, self.pixel_threshold)
+                if since_capture is None or (
+                        changed >= self.threshold and since_capture >= self.min_interval) or (
+                        self.max_interval > 0 and since_capture >= self.max_interval):
+                    self.capture()
+                    self.captured += 1
+                    captured_sample = sample
+                    last_capture = now
+                # 画面静止时逐渐降低采样频率
+                if changed_fraction(sample, last_sample, self.pixel_threshold) > 0:
+                    interval = self.sample_interval
+                else:
+                    interval = min(interval * 1.5, self.max_sample_interval)
+                last_sample = sample
+                if self.max_interval > 0:
+                    interval = max(self.sample_interval, min(interval, self.max_interval - (now - last_capture)))
+            except Exception:
+                output(traceback.format_exc())
+                interval = self.max_sample_interval
+            self.stop_event.wait(interval)
+
+    def stats(self) -> dict:
+        return dict(sampled=self.sampled, captured=self.captured,
+                    mean_sample_time=self.sample_time / self.sampled if self.sampled else 0)
+
+
+class NotificationDispatcher:
+    """
+    Show notifications from a thread of their own, at most one every `min_interval` seconds.
+    Messages arriving in between are merged into one by `merge`.
+    """
+
+    def __init__(self, send: Callable[[str], Any], min_interval: float = 2.0,
+                 merge: Callable[[list], str] = None):
+        self.send = send
+        self.min_interval = min_interval
+        self.merge = merge if merge is not None else (lambda messages: f"{len(messages)} notifications")
+        self.pending: list[str] = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread: (threading.Thread, None) = None
+        self.sent = 0
+        self.merged = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop after sending what is pending."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def notify(self, message: str):
+        with self.condition:
+            self.pending.append(message)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                messages, self.pending = self.pending, []
+            try:
+                self.send(messages[0] if len(messages) == 1 else self.merge(messages))
+            except Exception:
+                output(traceback.format_exc())
+            self.sent += 1
+            self.merged += len(messages) - 1
+            # throttle, messages arriving meanwhile are merged
+            with self.condition:
+                if self.running:
+                    self.condition.wait_for(lambda: not self.running, timeout=self.min_interval)
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportJob:
+    """One export run by an ExportQueue, `run(job)` reports its steps (pages mostly) through `job.progress`."""
+
+    def __init__(self, name: str, run: Callable[["ExportJob"], Any], options: dict = None):
+        self.name = name
+        self.run = run
+        # keyword arguments of the export (workers, scale, crop, volume limits), taken when the job is queued
+        self.options: dict = options or {}
+        # "queued", "running", "done", "cancelled" or "failed"
+        self.state = "queued"
+        self.done = 0
+        self.total = 0
+        self.start_time: (float, None) = None
+        self.cancel_event = threading.Event()
+        self.listener: (Callable[["ExportJob"], Any], None) = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ExportCancelled(self.name)
+
+    def progress(self, done: int, total: int):
+        """Called for every step, raises ExportCancelled once the job is cancelled."""
+        self.done, self.total = done, total
+        if self.listener is not None:
+            self.listener(self)
+        self.check_cancelled()
+
+    def eta(self) -> (float, None):
+        """Seconds left, estimated from the steps done so far."""
+        if not self.done or self.start_time is None:
+            return None
+        return (time.monotonic() - self.start_time) / self.done * (self.total - self.done)
+
+
+class ExportQueue:
+    """Run export jobs one after another in a thread of its own, `on_update(job)` is called on every change."""
+
+    def __init__(self, on_update: Callable[[ExportJob], Any] = None):
+        self.on_update = on_update
+        self.jobs: deque[ExportJob] = deque()
+        self.current: (ExportJob, None) = None
+        self.condition = threading.Condition()
+        self.thread: (threading.Thread, None) = None
+
+    def submit(self, job: ExportJob):
+        job.listener = self.update
+        with self.condition:
+            self.jobs.append(job)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        self.update(job)
+
+    def cancel(self):
+        """Cancel the running job, queued jobs still run."""
+        with self.condition:
+            if self.current is not None:
+                self.current.cancel()
+
+    def pending(self) -> list:
+        with self.condition:
+            return list(self.jobs)
+
+    def busy(self) -> bool:
+        with self.condition:
+            return self.current is not None or bool(self.jobs)
+
+    def wait(self, timeout: float = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.current is None and not self.jobs, timeout)
+
+    def update(self, job: ExportJob):
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception:
+                output(traceback.format_exc())
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                job = self.current = self.jobs.popleft()
+            job.start_time = time.monotonic()
+            job.state = "running"
+            self.update(job)
+            try:
+                job.check_cancelled()
+                job.run(job)
+                job.state = "done"
+            except ExportCancelled:
+                job.state = "cancelled"
+                output(f"Export \"{job.name}\" cancelled")
+            except Exception:
+                job.state = "failed"
+                output(traceback.format_exc())
+            with self.condition:
+                self.current = None
+                self.condition.notify_all()
+            self.update(job)
+
+
+class CaptureFrame:
+    def __init__(self, name: str, path: str, request_time: float = None):
+        self.seq: int = -1
+        self.name = name
+        self.path = path
+        self.image: (Image.Image, None) = None
+        self.request_time = time.time() if request_time is None else request_time
+        self.grab_time: (float, None) = None
+        # frame time - request_time of frames taken from the pre-capture buffer
+        self.press_offset: (float, None) = None
+        self.region: (tuple, None) = None
+        self.hash: (int, None) = None
+        self.duplicate = False
+        # "palette", "lossless" or "jpeg" when the encoding is chosen by content
+        self.encoding: (str, None) = None
+
+
+def difference_hash(img: Image.Image, hash_size: int = 8) -> int:
+    """dHash: sign of the horizontal gradient of a (hash_size + 1) x hash_size grayscale thumbnail."""
+    small = img.resize((hash_size + 1, hash_size), Image.BOX, reducing_gap=2.0).convert("L")
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+class Histogram:
+    """Durations in log-spaced buckets, memory does not grow with the number of samples."""
+
+    # upper bounds of the buckets in seconds, the last bucket is unbounded
+    bounds = [bound * scale for scale in (1e-4, 1e-3, 1e-2, 1e-1, 1, 10) for bound in (1, 1.5, 2, 3, 5, 7)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the `fraction` percentile, capped by the max."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(count=self.count, mean=self.total / self.count if self.count else 0.0,
+                    p50=self.percentile(0.5), p90=self.percentile(0.9), p99=self.percentile(0.99), max=self.max,
+                    buckets={("inf" if index == len(self.bounds) else f"{self.bounds[index]:g}"): count
+                             for index, count in enumerate(self.buckets) if count})
+
+
+class Metrics:
+    """Timing histograms per stage and counters of a catching session, shared by all capture threads."""
+
+    stages = ["hotkey", "grab", "notification", "encode", "write", "pdf_page", "pdf_finalize", "clipboard"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: dict[str, Histogram] = {stage: Histogram() for stage in self.stages}
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, tuple] = {}  # name -> (last, max)
+        self.start_time = time.time()
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].add(seconds)
+
+    def timer(self, stage: str):
+        metrics = self
+
+        class StageTimer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *_):
+                metrics.record(stage, time.perf_counter() - self.start)
+
+        return StageTimer()
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = (value, max(value, self.gauges.get(name, (0, value))[1]))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(start_time=self.start_time, duration=time.time() - self.start_time,
+                        counters=dict(self.counters),
+                        gauges={name: dict(last=last, max=maximum) for name, (last, maximum) in self.gauges.items()},
+                        stages={stage: histogram.to_dict() for stage, histogram in self.histograms.items()})
+
+    def summary(self) -> str:
+        """One line for the stats panel."""
+        with self.lock:
+            parts = [f"Frames {self.counters.get('frames', 0)}",
+                     f"{self.counters.get('bytes', 0) / 1024 / 1024:.1f} MiB"]
+            if "queue_depth" in self.gauges:
+                last, maximum = self.gauges["queue_depth"]
+                parts.append(f"Queue {last} (max {maximum})")
+            for stage in self.stages:
+                histogram = self.histograms[stage]
+                if histogram.count:
+                    parts.append(f"{stage} p50 {histogram.percentile(0.5) * 1000:.0f}/"
+                                 f"p90 {histogram.percentile(0.9) * 1000:.0f} ms")
+        return " | ".join(parts)
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+
+class DuplicateFilter:
+    """Compare every frame with the last kept frame by difference hash."""
+
+    def __init__(self, threshold: int = 0, hash_size: int = 8):
+        # frames within `threshold` differing hash bits of the last kept frame are duplicates
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.last_hash: (int, None) = None
+        self.hashed = 0
+        self.duplicates = 0
+        self.hash_time = 0.0
+
+    def check(self, img: Image.Image) -> (int, bool):
+        start = time.perf_counter()
+        img_hash = difference_hash(img, self.hash_size)
+        self.hash_time += time.perf_counter() - start
+        self.hashed += 1
+        duplicate = self.last_hash is not None and (img_hash ^ self.last_hash).bit_count() <= self.threshold
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.last_hash = img_hash
+        return img_hash, duplicate
+
+    def stats(self) -> dict:
+        mean_hash_time = self.hash_time / self.hashed if self.hashed else 0.0
+        return dict(hashed=self.hashed, duplicates=self.duplicates, mean_hash_time=mean_hash_time)
+
+
+class CapturePipeline:
+    """
+    One grab thread feeding a bounded frame queue drained by `workers` encoder threads.
+    A full queue blocks the grab thread for up to `backpressure_timeout` seconds, then the frame is dropped.
+    `grab` returns None to skip a frame.
+    """
+
+    def __init__(self, grab: Callable[[CaptureFrame], Image.Image], encode: Callable[[CaptureFrame], Any],
+                 workers: int = 2, queue_size: int = 8, backpressure_timeout: float = 5,
+                 discard: Callable[[CaptureFrame], Any] = None, first_seq: int = 0):
+        self.grab = grab
+        self.first_seq = first_seq
+        self.encode = encode
+        # called for every frame that will never be encoded
+        self.discard = discard
+        self.workers_count = max(1, workers)
+        self.backpressure_timeout = backpressure_timeout
+        self.request_queue = Queue()
+        self.frame_queue = Queue(maxsize=max(1, queue_size))
+        self.grab_thread: (threading.Thread, None) = None
+        self.worker_threads: list[threading.Thread] = []
+        self.counter_lock = threading.Lock()
+        self.requested = 0
+        self.grabbed = 0
+        self.encoded = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.running = False
+
+    @property
+    def queue_depth(self) -> int:
+        return self.frame_queue.qsize()
+
+    def stats(self) -> dict:
+        with self.counter_lock:
+            return dict(requested=self.requested, grabbed=self.grabbed, encoded=self.encoded, skipped=self.skipped,
+                        dropped=self.dropped, failed=self.failed, queue_depth=self.queue_depth,
+                        max_queue_depth=self.max_queue_depth)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.worker_threads = [threading.Thread(target=self.run_encode, daemon=True)
+                               for _ in range(self.workers_count)]
+        for worker_thread in self.worker_threads:
+            worker_thread.start()
+        self.grab_thread = threading.Thread(target=self.run_grab, daemon=True)
+        self.grab_thread.start()
+
+    def submit(self, frame: CaptureFrame) -> bool:
+        if not self.running:
+            return False
+        with self.counter_lock:
+            frame.seq = self.first_seq + self.requested
+            self.requested += 1
+        self.request_queue.put(frame)
+        return True
+
+    def stop(self, timeout: float = None) -> dict:
+        """Stop accepting frames and wait until every grabbed frame is encoded."""
+        if self.running:
+            self.running = False
+            self.request_queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in [self.grab_thread] + self.worker_threads:
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return self.stats()
+
+    def run_grab(self):
+        while True:
+            frame: CaptureFrame = self.request_queue.get()
+            if frame is None:
+                break
+            try:
+                frame.image = self.grab(frame)
+                frame.grab_time = time.time()
+            except Exception:
+                output(traceback.format_exc())
+                with self.counter_lock:
+                    self.failed += 1
+                self.discard_frame(frame)
+                continue
+            if frame.image is None:
+                with self.counter_lock:
+                    self.skipped += 1
+                self.discard_frame(frame)
+                continue
+            with self.counter_lock:
+                self.grabbed += 1
+            try:
+                self.frame_queue.put(frame, timeout=self.backpressure_timeout)
+            except Full:
+                with self.counter_lock:
+                    self.dropped += 1
+                output(f"Warning: encoder queue full, screenshot \"{frame.name}\" dropped")
+                self.discard_frame(frame)
+                continue
+            with self.counter_lock:
+                self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        # all requests are grabbed, tell every encoder to finish
+        for _ in self.worker_threads:
+            self.frame_queue.put(None)
+
+    def run_encode(self):
+        while True:
+            frame: CaptureFrame = self.frame_queue.get()
+            if frame is None:
+                return
+            try:
+                self.encode(frame)
+                with self.counter_lock:
+                    self.encoded += 1
+            except Exception:
+                output(traceback.format_exc())
+                with self.counter_lock:
+                    self.failed += 1
+                self.discard_frame(frame)
+            finally:
+                frame.image = None
+
+    def discard_frame(self, frame: CaptureFrame):
+        frame.image = None
+        if self.discard is not None:
+            try:
+                self.discard(frame)
+            except Exception:
+                output(traceback.format_exc())
+
+
+class PDFImage:
+    """Encoded pixel data ready to be embedded as a PDF image XObject."""
+
+    color_spaces = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+    # PNG color type: (colors, color space), palette images get an /Indexed color space
+    png_color_types = {0: (1, "/DeviceGray"), 2: (3, "/DeviceRGB"), 3: (1, None)}
+
+    def __init__(self, width: int, height: int, data: bytes, filter_name: str, color_space: str = "/DeviceRGB",
+                 bits: int = 8, decode_parms: str = None, decode: str = None):
+        self.width = width
+        self.height = height
+        self.data = data
+        self.filter_name = filter_name
+        self.color_space = color_space
+        self.bits = bits
+        self.decode_parms = decode_parms
+        self.decode = decode
+        # (width, height) of its page in points, None: 1 pt per pixel
+        self.page_size: (tuple, None) = None
+
+    @classmethod
+    def from_jpeg(cls, data: bytes, width: int, height: int, components: int = 3):
+        # JPEG bytes are embedded as they are
+        # Adobe CMYK JPEGs are stored inverted
+        decode = "[1 0 1 0 1 0 1 0]" if components == 4 else None
+        return cls(width, height, data, "DCTDecode", color_space=cls.color_spaces[components], decode=decode)
+
+    @staticmethod
+    def read_jpeg_header(data: bytes) -> (int, int, int):
+        """Return (width, height, components) from the SOF marker, without decoding."""
+        if data[:2] != b"\xff\xd8":
+            raise ValueError("Not a JPEG file")
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                raise ValueError("Broken JPEG marker")
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+            length = int.from_bytes(data[pos + 2:pos + 4], "big")
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height = int.from_bytes(data[pos + 5:pos + 7], "big")
+                width = int.from_bytes(data[pos + 7:pos + 9], "big")
+                return width, height, data[pos + 9]
+            pos += 2 + length
+        raise ValueError("No JPEG frame header found")
+
+    @classmethod
+    def from_jpeg_bytes(cls, data: bytes):
+        width, height, components = cls.read_jpeg_header(data)
+        return cls.from_jpeg(data, width, height, components)
+
+    @classmethod
+    def from_png_bytes(cls, data: bytes):
+        """
+        Embed the zlib stream of a PNG as it is, PDF understands the PNG row filters (/Predictor 15).
+        Return None for interlaced PNGs and PNGs with an alpha channel.
+        """
+        if data[:8] != b"\x89PNG\r\n\x1a\n":
+            raise ValueError("Not a PNG file")
+        pos = 8
+        header = None
+        palette = b""
+        idat = []
+        while pos + 8 <= len(data):
+            length = int.from_bytes(data[pos:pos + 4], "big")
+            chunk_type = data[pos + 4:pos + 8]
+            chunk = data[pos + 8:pos + 8 + length]
+            pos += 12 + length
+            if chunk_type == b"IHDR":
+                header = chunk
+            elif chunk_type == b"PLTE":
+                palette = chunk
+            elif chunk_type == b"IDAT":
+                idat.append(chunk)
+            elif chunk_type == b"IEND":
+                break
+        if header is None:
+            raise ValueError("No PNG header found")
+        width = int.from_bytes(header[0:4], "big")
+        height = int.from_bytes(header[4:8], "big")
+        bits, color_type, interlace = header[8], header[9], header[12]
+        if interlace != 0 or color_type not in cls.png_color_types:
+            return None
+        colors, color_space = cls.png_color_types[color_type]
+        if color_type == 3:
+            color_space = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]"
+        decode_parms = f"<< /Predictor 15 /Colors {colors} /BitsPerComponent {bits} /Columns {width} >>"
+        return cls(width, height, b"".join(idat), "FlateDecode", color_space=color_space, bits=bits,
+                   decode_parms=decode_parms)
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """JPEG and plain PNG data is embedded without decoding, anything else goes through PIL."""
+        if data[:2] == b"\xff\xd8":
+            return cls.from_jpeg_bytes(data)
+        if data[:8] == b"\x89PNG\r\n\x1a\n":
+            pdf_image = cls.from_png_bytes(data)
+            if pdf_image is not None:
+                return pdf_image
+        with Image.open(io.BytesIO(data)) as img:
+            return cls.from_image(img)
+
+    @classmethod
+    def from_image(cls, img: Image.Image, compress_level: int = 6):
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        width, height = img.size
+        return cls(width, height, zlib.compress(img.tobytes(), compress_level), "FlateDecode",
+                   color_space=cls.color_spaces[len(img.mode)])
+
+
+class PDFWriter:
+    """
+    Write a PDF of one image per page incrementally, each page goes to disk as soon as it is added.
+    close() only writes the page tree, xref and trailer.
+    Identical images are written once and shared by their pages.
+    Past `max_pages` pages or `max_bytes` bytes (0: no limit) the PDF is split into volumes
+    "<name>-001.pdf", "<name>-002.pdf", ..., a PDF which fits in one volume keeps its name.
+    """
+
+    catalog_obj = 1
+    pages_obj = 2
+
+    def __init__(self, path: str, atomic: bool = False, max_pages: int = 0, max_bytes: int = 0):
+        # atomic: write "<path>.part" and rename it to `path` once closed
+        self.path = path
+        self.atomic = atomic
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        # finished volumes, every PDF written once closed
+        self.paths: list[str] = []
+        self.volume = 1
+        self.volume_page_count = 0
+        self.pending_pages: dict[int, (tuple, None)] = {}
+        self.next_seq = 0
+        self.shared_images = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        self.open_volume(path)
+
+    def open_volume(self, path: str):
+        self.write_path = path + ".part" if self.atomic else path
+        self.file = open(self.write_path, "wb")
+        self.offsets: dict[int, int] = {}
+        self.next_obj = 3
+        self.page_objs: list[int] = []
+        # content hash of written images -> image obj, page size -> content obj
+        self.image_objs: dict[bytes, int] = {}
+        self.content_objs: dict[tuple, int] = {}
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def finish_volume(self, path: str):
+        kids = " ".join(f"{obj} 0 R" for obj in self.page_objs)
+        self.write_obj(self.pages_obj, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_objs)} >>")
+        self.write_obj(self.catalog_obj, f"<< /Type /Catalog /Pages {self.pages_obj} 0 R >>")
+        xref_offset = self.file.tell()
+        xref = [f"xref\n0 {self.next_obj}\n", "0000000000 65535 f \n"]
+        xref += [f"{self.offsets[obj]:010d} 00000 n \n" for obj in range(1, self.next_obj)]
+        xref.append(f"trailer\n<< /Size {self.next_obj} /Root {self.catalog_obj} 0 R >>\n"
+                    f"startxref\n{xref_offset}\n%%EOF\n")
+        self.file.write("".join(xref).encode("latin-1"))
+        self.file.close()
+        if self.write_path != path:
+            os.replace(self.write_path, path)
+        self.paths.append(path)
+        self.volume_page_count += len(self.page_objs)
+        self.page_objs = []
+
+    def volume_full(self, image: PDFImage) -> bool:
+        if not self.page_objs:
+            return False
+        if self.max_pages and len(self.page_objs) >= self.max_pages:
+            return True
+        # the page tree and xref take about 30 bytes per object
+        return bool(self.max_bytes) and self.file.tell() + len(image.data) + 30 * self.next_obj > self.max_bytes
+
+    def next_volume(self):
+        self.finish_volume(pdf_volume_path(self.path, self.volume))
+        self.volume += 1
+        self.open_volume(pdf_volume_path(self.path, self.volume))
+
+    @property
+    def page_count(self) -> int:
+        return self.volume_page_count + len(self.page_objs)
+
+    def new_obj(self) -> int:
+        obj = self.next_obj
+        self.next_obj += 1
+        return obj
+
+    def write_obj(self, obj: int, body: str, stream: bytes = None):
+        self.offsets[obj] = self.file.tell()
+        if stream is None:
+            self.file.write(f"{obj} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+        else:
+            self.file.write(f"{obj} 0 obj\n{body}\nstream\n".encode("latin-1"))
+            self.file.write(stream)
+            self.file.write(b"\nendstream\nendobj\n")
+
+    def write_image(self, image: PDFImage) -> int:
+        image_hash = hashlib.blake2b(image.data, digest_size=16)
+        image_hash.update(f"{image.width} {image.height} {image.color_space} {image.bits} {image.filter_name} "
+                          f"{image.decode_parms} {image.decode}".encode("latin-1"))
+        image_hash = image_hash.digest()
+        if image_hash in self.image_objs:
+            self.shared_images += 1
+            return self.image_objs[image_hash]
+        obj = self.new_obj()
+        self.image_objs[image_hash] = obj
+        body = (f"<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+                f"/ColorSpace {image.color_space} /BitsPerComponent {image.bits} /Filter /{image.filter_name} ")
+        if image.decode_parms:
+            body += f"/DecodeParms {image.decode_parms} "
+        if image.decode:
+            body += f"/Decode {image.decode} "
+        body += f"/Length {len(image.data)} >>"
+        self.write_obj(obj, body, image.data)
+        return obj
+
+    def write_page(self, image: PDFImage, width: float = None, height: float = None):
+        page_width, page_height = image.page_size or (image.width, image.height)
+        if width is None:
+            width = page_width
+        if height is None:
+            height = page_height
+        if self.volume_full(image):
+            self.next_volume()
+        image_obj = self.write_image(image)
+        content_obj = self.content_objs.get((width, height))
+        if content_obj is None:
+            content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode("latin-1")
+            content_obj = self.new_obj()
+            self.write_obj(content_obj, f"<< /Length {len(content)} >>", content)
+            self.content_objs[(width, height)] = content_obj
+        page_obj = self.new_obj()
+        self.write_obj(page_obj, f"<< /Type /Page /Parent {self.pages_obj} 0 R /MediaBox [0 0 {width} {height}] "
+                                 f"/Resources << /XObject << /Im0 {image_obj} 0 R >> >> "
+                                 f"/Contents {content_obj} 0 R >>")
+        self.page_objs.append(page_obj)
+
+    def add_page(self, image: PDFImage, width: float = None, height: float = None, seq: int = None):
+        """Add a page showing `image`, sized in points (default 1px = 1pt)."""
+        with self.lock:
+            if self.closed:
+                raise ValueError(f"PDF\"{self.path}\" is closed")
+            if seq is None:
+                self.write_page(image, width, height)
+                return
+            self.pending_pages[seq] = (image, width, height)
+            self.flush_pending()
+
+    def skip(self, seq: int):
+        """Mark `seq` as never coming, so later pages are not held back."""
+        with self.lock:
+            self.pending_pages[seq] = None
+            self.flush_pending()
+
+    def flush_pending(self, flush_all=False):
+        while self.pending_pages:
+            if self.next_seq not in self.pending_pages:
+                if not flush_all:
+                    return
+                self.next_seq = min(self.pending_pages)
+            page = self.pending_pages.pop(self.next_seq)
+            self.next_seq += 1
+            if page is not None:
+                self.write_page(*page)
+
+    def close(self) -> int:
+        with self.lock:
+            if self.closed:
+                return self.page_count
+            self.flush_pending(flush_all=True)
+            self.finish_volume(self.path if self.volume == 1 else pdf_volume_path(self.path, self.volume))
+            self.closed = True
+            return self.page_count
+
+    def discard(self):
+        """Close without finishing the document and delete it, with the volumes written so far."""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+            self.closed = True
+            for path in self.paths + [self.write_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.paths = []
+
+
+def pdf_volume_path(pdf_path: str, volume: int) -> str:
+    root, extension = os.path.splitext(pdf_path)
+    return f"{root}-{volume:03d}{extension}"
+
+
+def remove_pdf_part(pdf_path: str):
+    """Delete the unfinished volume an atomic PDFWriter left behind, if its process ended before close()."""
+    volume = 1
+    while os.path.exists(pdf_volume_path(pdf_path, volume)):
+        volume += 1
+    for part_path in (pdf_path + ".part", pdf_volume_path(pdf_path, volume) + ".part"):
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def export_worker_count(workers: int = 0) -> int:
+    # 0: one worker per core
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def image_stats(img: Image.Image, row_step: int = 8) -> dict:
+    """
+    Cheap statistics to choose an encoding by: the colors of an RGB image (None past 256 and for other modes),
+    and the fraction of flat and of hard edged steps between neighbouring pixels, on the green channel of every
+    `row_step`-th row.
+    """
+    colors = img.getcolors(256) if img.mode == "RGB" else None
+    channel = img.getchannel("G") if "G" in img.getbands() else img.convert("L")
+    steps = np.abs(np.diff(np.asarray(channel)[::row_step].astype(np.int16), axis=1))
+    flat = float(np.mean(steps == 0)) if steps.size else 1.0
+    edges = float(np.mean(steps > 64)) if steps.size else 0.0
+    # share of the changing steps which are hard edges: high for text and UI, low for photos and gradients
+    sharpness = edges / (1 - flat) if flat < 1 else 1.0
+    return dict(colors=colors, flat=flat, edges=edges, sharpness=sharpness)
+
+
+def choose_encoding(stats: dict, palette_sharpness: float = 0.1, lossless_sharpness: float = 0.3,
+                    lossless_edges: float = 0.1) -> str:
+    """
+    Encoding for an image with these image_stats, each image is encoded once.
+    "palette": up to 256 colors and some hard edges (UI, text), exact as an indexed PNG and far smaller than
+    JPEG. Smooth content with few colors (gradients) is smaller as JPEG.
+    "lossless": more colors and dense hard edges (code, text on many colors), which cost JPEG as much.
+    A few edges around a photo on screen do not, it is smaller as JPEG.
+    "jpeg": the rest (photos, video, gradients).
+    """
+    if stats["colors"] is not None and stats["sharpness"] >= palette_sharpness:
+        return "palette"
+    if stats["sharpness"] >= lossless_sharpness and stats["edges"] >= lossless_edges:
+        return "lossless"
+    return "jpeg"
+
+
+def encode_palette_png(img: Image.Image, colors: list) -> bytes:
+    """Indexed PNG of an RGB image with the `colors` of getcolors(), every pixel keeps its exact color."""
+    palette = bytes(channel for _, color in colors for channel in color)
+    # RGBX pixels read as uint32, the palette the same way, so each pixel is looked up by one search
+    keys = np.frombuffer(b"".join(palette[i:i + 3] + b"\xff" for i in range(0, len(palette), 3)), dtype=np.uint32)
+    order = np.argsort(keys)
+    pixels = np.asarray(img.convert("RGBX")).view(np.uint32)[..., 0]
+    indices = order[np.searchsorted(keys[order], pixels)].astype(np.uint8)
+    indexed = Image.fromarray(indices, "P")
+    indexed.putpalette(palette)
+    bits = next(bits for bits in (1, 2, 4, 8) if len(colors) <= 1 << bits)
+    buffer = io.BytesIO()
+    indexed.save(buffer, format="PNG", bits=bits)
+    return buffer.getvalue()
+
+
+def encode_image_auto(img: Image.Image, quality: int = 85) -> (bytes, str, str):
+    """Encode by content, see choose_encoding. Return (data, extension, encoding)."""
+    stats = image_stats(img)
+    encoding = choose_encoding(stats)
+    if encoding == "jpeg" and img.mode not in ("L", "RGB", "CMYK"):
+        # alpha and palette images stay PNG
+        encoding = "lossless"
+    if encoding == "palette":
+        return encode_palette_png(img, stats["colors"]), ".png", encoding
+    extension = ".jpg" if encoding == "jpeg" else ".png"
+    return encode_image(img, extension, quality), extension, encoding
+
+
+def encode_image(img: Image.Image, extension: str, quality: int = 85) -> bytes:
+    """Encode as ".jpg" or ".png", "auto" chooses by the content of the image, see encode_image_auto."""
+    if extension == "auto":
+        return encode_image_auto(img, quality)[0]
+    buffer = io.BytesIO()
+    if extension == ".jpg":
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ExportScale:
+    """
+    Page size of exported images. Images are downscaled to fit `max_width` x `max_height` pixels and to `dpi`
+    for screenshots of `screen_dpi` (192 on a 200% display), never upscaled, 0: no limit.
+    With `dpi` a page keeps the physical size of the screen, otherwise it is 1 pt per pixel of its image.
+    Images with a box in `crop_boxes`, (width, height) -> (left, top, right, bottom), are cropped to it first,
+    see BorderCrop. Downscaled or cropped images are re-encoded with `quality` and cached in `cache_dir_path`.
+    """
+
+    cache_name = ".resampled"
+
+    def __init__(self, max_width: int = 0, max_height: int = 0, dpi: float = 0, screen_dpi: float = 96,
+                 quality: int = 85, cache_dir_path: str = None, crop_boxes: dict = None):
+        self.max_width = max_width
+        self.max_height = max_height
+        self.dpi = dpi
+        self.screen_dpi = screen_dpi if screen_dpi > 0 else 96
+        self.quality = quality
+        self.cache_dir_path = cache_dir_path
+        self.crop_boxes = crop_boxes or {}
+
+    @property
+    def active(self) -> bool:
+        return bool(self.max_width or self.max_height or self.dpi or self.crop_boxes)
+
+    def with_cache(self, cache_dir_path: (str, None)):
+        return ExportScale(self.max_width, self.max_height, self.dpi, self.screen_dpi, self.quality, cache_dir_path,
+                           self.crop_boxes)
+
+    def with_crop_boxes(self, crop_boxes: dict):
+        return ExportScale(self.max_width, self.max_height, self.dpi, self.screen_dpi, self.quality,
+                           self.cache_dir_path, crop_boxes)
+
+    def crop_box(self, width: int, height: int) -> (tuple, None):
+        return self.crop_boxes.get((width, height))
+
+    def fit(self, width: int, height: int) -> (tuple, tuple):
+        """Return the (width, height) in pixels and the page (width, height) in points of a `width` x `height` image."""
+        scale = 1.0
+        if self.dpi:
+            scale = min(scale, self.dpi / self.screen_dpi)
+        if self.max_width:
+            scale = min(scale, self.max_width / width)
+        if self.max_height:
+            scale = min(scale, self.max_height / height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if self.dpi:
+            return size, (round(width * 72 / self.screen_dpi, 2), round(height * 72 / self.screen_dpi, 2))
+        return size, size
+
+    def cache_path(self, img_path, size: tuple, box: tuple = None) -> (str, None):
+        if self.cache_dir_path is None or isinstance(img_path, bytes):
+            return None
+        key = hashlib.blake2b(digest_size=16)
+        if isinstance(img_path, TileFrame):
+            key.update(json.dumps([img_path.pack_path, img_path.tiles, img_path.extension]).encode("utf-8"))
+        else:
+            stat = os.stat(img_path)
+            key.update(f"{os.path.abspath(img_path)} {stat.st_size} {stat.st_mtime_ns}".encode("utf-8"))
+        key.update(f"{size} {box} {self.quality}".encode("latin-1"))
+        return os.path.join(self.cache_dir_path, key.hexdigest())
+
+
+def resample_image(img: Image.Image, size: tuple, box: tuple = None) -> Image.Image:
+    """
+    Downscale to `size`, or the `box` (left, top, right, bottom) of the image to `size`.
+    A JPEG not decoded yet is decoded at 1/2, 1/4 or 1/8 scale straight from its DCT data,
+    the rest is reduced by whole factors with a box filter before the final Lanczos pass.
+    """
+    if box is not None and size == (box[2] - box[0], box[3] - box[1]):
+        return img.crop(box)
+    full_width = img.width
+    img.draft(img.mode, size if box is None else (size[0] * img.width // (box[2] - box[0]),
+                                                  size[1] * img.height // (box[3] - box[1])))
+    if box is not None and img.width != full_width:
+        box = tuple(position * img.width / full_width for position in box)
+    if img.mode in ("1", "P"):
+        # palette images would only get nearest neighbour resampling
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    return img.resize(size, Image.LANCZOS, box=box, reducing_gap=2.0)
+
+
+def image_size(img_path) -> tuple:
+    """Size of an image file, encoded image or TileFrame, from its header only."""
+    if isinstance(img_path, TileFrame):
+        return img_path.size
+    with Image.open(io.BytesIO(img_path) if isinstance(img_path, bytes) else img_path) as img:
+        return img.size
+
+
+def open_image(img_path) -> Image.Image:
+    if isinstance(img_path, TileFrame):
+        return img_path.image()
+    return Image.open(io.BytesIO(img_path) if isinstance(img_path, bytes) else img_path)
+
+
+class BorderCrop:
+    """
+    Find what stays the same on every frame of a session (taskbar, desktop margins, window chrome) to crop it off.
+    A pixel is static if its channels vary by at most `threshold` over the frames, the crop box is the bounding
+    box of the pixels which are not, grown by `padding`.
+    With `per_monitor` frames of each size (a monitor, a window size) get a box of their own, otherwise all frames
+    share one box, aligned at their top left corner.
+    """
+
+    def __init__(self, padding: int = 16, threshold: int = 8, per_monitor: bool = True, min_frames: int = 2):
+        self.padding = max(0, padding)
+        self.threshold = threshold
+        self.per_monitor = per_monitor
+        # fewer frames of a size tell nothing about what changes
+        self.min_frames = max(2, min_frames)
+
+    def find_boxes(self, img_paths: list, progress: Callable[[int, int], Any] = None) -> dict:
+        """
+        Return (width, height) -> crop box of the frames in `img_paths`, sizes without a box are not cropped.
+        Frames are decoded one at a time, a group of frames keeps only its running minimum and maximum.
+        """
+        sizes = [image_size(img_path) for img_path in img_paths]
+        groups = {}
+        for img_path, size in zip(img_paths, sizes):
+            groups.setdefault(size if self.per_monitor else None, []).append(img_path)
+        boxes = {}
+        done = 0
+        for key, group in groups.items():
+            if len(group) < self.min_frames:
+                done += len(group)
+                continue
+            if key is None:
+                canvas_size = (max(width for width, _ in sizes), max(height for _, height in sizes))
+            else:
+                canvas_size = key
+            low = np.full((canvas_size[1], canvas_size[0], 3), 255, dtype=np.uint8)
+            high = np.zeros_like(low)
+            # frames on each pixel, frames of different sizes cover only part of a shared canvas
+            coverage = np.zeros(low.shape[:2], dtype=np.uint32)
+            for img_path in group:
+                with open_image(img_path) as img:
+                    pixels = np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+                height, width = pixels.shape[:2]
+                np.minimum(low[:height, :width], pixels, out=low[:height, :width])
+                np.maximum(high[:height, :width], pixels, out=high[:height, :width])
+                coverage[:height, :width] += 1
+                done += 1
+                if progress is not None:
+                    progress(done, len(img_paths))
+            # too few frames on a pixel tell nothing, it is kept
+            varying = ((high - low).max(axis=2) > self.threshold) | ((coverage > 0) & (coverage < self.min_frames))
+            del low, high, coverage
+            box = self.varying_box(varying)
+            if box is None:
+                continue
+            for size in (set(sizes) if key is None else (key,)):
+                clipped = (box[0], box[1], min(box[2], size[0]), min(box[3], size[1]))
+                if clipped != (0, 0) + size and clipped[0] < clipped[2] and clipped[1] < clipped[3]:
+                    boxes[size] = clipped
+        return boxes
+
+    def varying_box(self, varying: np.ndarray) -> (tuple, None):
+        rows = np.flatnonzero(varying.any(axis=1))
+        columns = np.flatnonzero(varying.any(axis=0))
+        if not rows.size:
+            # nothing changes at all, nothing to tell the borders from
+            return None
+        height, width = varying.shape
+        return (max(0, int(columns[0]) - self.padding), max(0, int(rows[0]) - self.padding),
+                min(width, int(columns[-1]) + 1 + self.padding), min(height, int(rows[-1]) + 1 + self.padding))
+
+
+def prepare_scaled_pdf_image(img_path, scale: ExportScale) -> PDFImage:
+    if isinstance(img_path, TileFrame):
+        img, extension = img_path.image(), img_path.extension
+    else:
+        img = Image.open(io.BytesIO(img_path) if isinstance(img_path, bytes) else img_path)
+        extension = ".jpg" if img.format == "JPEG" else ".png"
+    with img:
+        box = scale.crop_box(*img.size)
+        size, page_size = scale.fit(*(img.size if box is None else (box[2] - box[0], box[3] - box[1])))
+        if box is None and size == img.size:
+            if isinstance(img_path, TileFrame):
+                pdf_image = PDFImage.from_bytes(encode_image(img, extension, img_path.quality))
+            elif isinstance(img_path, bytes):
+                pdf_image = PDFImage.from_bytes(img_path)
+            else:
+                pdf_image = PDFImage.from_file(img_path)
+        else:
+            cache_path = scale.cache_path(img_path, size, box)
+            if cache_path is not None and os.path.exists(cache_path):
+                with open(cache_path, "rb") as file:
+                    data = file.read()
+            else:
+                data = encode_image(resample_image(img, size, box), extension, scale.quality)
+                if cache_path is not None:
+                    # workers may write the same entry, each through a file of its own
+                    os.makedirs(scale.cache_dir_path, exist_ok=True)
+                    part_path = f"{cache_path}.{os.getpid()}.part"
+                    with open(part_path, "wb") as file:
+                        file.write(data)
+                    os.replace(part_path, cache_path)
+            pdf_image = PDFImage.from_bytes(data)
+    pdf_image.page_size = page_size
+    return pdf_image
+
+
+def prepare_pdf_image(img_path, scale: ExportScale = None) -> (PDFImage, None, str):
+    """
+    Decode and compress one image file, encoded image or TileFrame, runs in the export process pool.
+    Return (PDFImage, None) or (None, error).
+    """
+    try:
+        if scale is not None and scale.active:
+            return prepare_scaled_pdf_image(img_path, scale), None
+        if isinstance(img_path, bytes):
+            return PDFImage.from_bytes(img_path), None
+        if isinstance(img_path, TileFrame):
+            return PDFImage.from_bytes(img_path.encode()), None
+        return PDFImage.from_file(img_path), None
+    except Exception:
+        name = "<memory>" if isinstance(img_path, bytes) else img_path
+        return None, f"{name}\n{traceback.format_exc()}"
+
+
+def iter_pdf_images(img_paths: list, workers: int = 1, scale: ExportScale = None):
+    """Yield the prepared image of every path in order, preparing up to 2 * `workers` images ahead in processes."""
+    workers = min(export_worker_count(workers), len(img_paths))
+    if workers <= 1:
+        for img_path in img_paths:
+            yield prepare_pdf_image(img_path, scale)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for img_path in img_paths:
+            futures.append(executor.submit(prepare_pdf_image, img_path, scale))
+            if len(futures) >= workers * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def save_img_paths_as_pdf(img_paths: list, pdf_save_path: str, workers: int = 1,
+                          progress: Callable[[int, int], Any] = None, max_pages: int = 0, max_bytes: int = 0,
+                          volumes: list = None, scale: ExportScale = None, crop: BorderCrop = None) -> int:
+    """
+    Export images one per page, JPEG and PNG data is copied into the PDF without re-encoding.
+    `img_paths` may also hold encoded images as bytes and TileFrame.
+    With `workers` > 1 images are prepared in a process pool, the pages keep the order of `img_paths`.
+    Each image is released once its page is written, memory does not grow with the number of pages.
+    `progress(done, total)` is called after every image, the PDF is deleted if it raises ExportCancelled.
+    The PDF is split past `max_pages` pages or `max_bytes` bytes, see PDFWriter, the path of every volume
+    written is appended to `volumes`. Pages are downscaled by `scale`, see ExportScale.
+    With `crop` the borders which stay the same on every image are cropped off, found in a first pass over
+    the images which counts in `progress` as well, `total` is then twice the images.
+    """
+    writer = PDFWriter(pdf_save_path, max_pages=max_pages, max_bytes=max_bytes)
+    steps = len(img_paths) * (2 if crop is not None else 1)
+    steps_done = 0
+    try:
+        if progress is not None:
+            progress(0, steps)
+        if crop is not None:
+            crop_boxes = crop.find_boxes(
+                img_paths, progress=None if progress is None else lambda done, total: progress(done, steps))
+            for size, box in crop_boxes.items():
+                output(f"Crop the borders of {size[0]}x{size[1]} images to {box}")
+            scale = (scale or ExportScale()).with_crop_boxes(crop_boxes)
+            steps_done = len(img_paths)
+            if progress is not None:
+                progress(steps_done, steps)
+        for done, (pdf_image, error) in enumerate(iter_pdf_images(img_paths, workers, scale), 1):
+            if pdf_image is None:
+                output(error)
+            else:
+                writer.add_page(pdf_image)
+            if progress is not None:
+                progress(steps_done + done, steps)
+    except ExportCancelled:
+        writer.discard()
+        raise
+    finally:
+        writer.close()
+    if writer.shared_images:
+        output(f"{writer.shared_images} of {writer.page_count} pages reuse the image of an earlier page")
+    if len(writer.paths) > 1:
+        output(f"PDF\"{pdf_save_path}\" split into {len(writer.paths)} volumes")
+    if volumes is not None:
+        volumes.extend(writer.paths)
+    return writer.page_count
+
+
+def session_img_paths(img_dir_path: str, extensions: tuple = (".jpg", ".png")) -> list:
+    """
+    Images of a session dir in capture order from its manifest, or the TileFrame of every frame of a tile session.
+    Dirs without a manifest are listed in name order.
+    """
+    if TileFrameStore.is_tile_dir(img_dir_path):
+        return TileFrameStore.load_frames(img_dir_path)
+    if SessionManifest.exists(img_dir_path):
+        return [os.path.join(img_dir_path, entry["name"]) for entry in SessionManifest.read(img_dir_path)
+                if entry["name"].endswith(extensions)]
+    return [os.path.join(img_dir_path, img_name) for img_name in sorted(os.listdir(img_dir_path))
+            if img_name.endswith(extensions)]
+
+
+def save_session_as_pdf(img_dir_path: str, pdf_save_path: str, extensions: tuple = (".jpg", ".png"),
+                        workers: int = 1, passthrough: bool = True, progress: Callable[[int, int], Any] = None,
+                        max_pages: int = 0, max_bytes: int = 0, volumes: list = None,
+                        scale: ExportScale = None, crop: BorderCrop = None) -> int:
+    """
+    `passthrough` False exports through fpdf, which keeps the whole PDF in memory and is neither split, scaled
+    nor cropped. Downscaled and cropped images are cached in the session dir.
+    """
+    img_paths = session_img_paths(img_dir_path, extensions)
+    if (scale is not None and scale.active) or crop is not None:
+        scale = (scale or ExportScale()).with_cache(os.path.join(img_dir_path, ExportScale.cache_name))
+    if passthrough or TileFrameStore.is_tile_dir(img_dir_path):
+        return save_img_paths_as_pdf(img_paths, pdf_save_path, workers=workers, progress=progress,
+                                     max_pages=max_pages, max_bytes=max_bytes, volumes=volumes, scale=scale,
+                                     crop=crop)
+    if volumes is not None:
+        volumes.append(pdf_save_path)
+    return save_img_paths_as_pdf_fpdf(img_paths, pdf_save_path, progress=progress)
+
+
+def export_session(img_dir_path: str, pdf_save_path: str, workers: int = 1, max_pages: int = 0,
+                   max_bytes: int = 0, scale: ExportScale = None, crop: BorderCrop = None) -> dict:
+    """Export one session dir for the command line, return its summary. Runs in the export process pool."""
+    summary = dict(dir=img_dir_path, pdf=pdf_save_path, volumes=[], images=0, pages=0, bytes=0, time=0.0,
+                   error=None)
+    start = time.perf_counter()
+    try:
+        if not os.path.isdir(img_dir_path):
+            raise FileNotFoundError(f"\"{img_dir_path}\" no found")
+        summary["images"] = len(session_img_paths(img_dir_path))
+        if summary["images"] == 0:
+            raise FileNotFoundError(f"No img file found in \"{img_dir_path}\"")
+        summary["pages"] = save_session_as_pdf(img_dir_path, pdf_save_path, workers=workers, max_pages=max_pages,
+                                               max_bytes=max_bytes, volumes=summary["volumes"], scale=scale,
+                                               crop=crop)
+        summary["bytes"] = sum(os.path.getsize(path) for path in summary["volumes"])
+        if summary["pages"] < summary["images"]:
+            summary["error"] = f"{summary['images'] - summary['pages']} images could not be exported"
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+    summary["time"] = round(time.perf_counter() - start, 3)
+    # output() of this process is not shown anywhere, hand it back with the summary
+    summary["messages"] = []
+    while not output_queue.empty():
+        summary["messages"].append(output_queue.get()["_str"])
+    return summary
+
+
+def save_img_paths_as_pdf_fpdf(img_paths: list, pdf_save_path: str, progress: Callable[[int, int], Any] = None) -> int:
+    """Export through fpdf, every image is decoded and compressed again."""
+    from fpdf import FPDF
+    pdf = FPDF(unit="pt")
+    pdf.set_auto_page_break(False)  # 自动分页设为False
+    for done, img_path in enumerate(img_paths):
+        if progress is not None:
+            progress(done, len(img_paths))
+        try:
+            with Image.open(img_path) as img:
+                width, height = img.size
+                # noinspection PyTypeChecker
+                pdf.add_page(format=(width, height))
+                pdf.image(img, x=0, y=0, w=width, h=height)  # 指定宽高
+        except Exception:
+            output(traceback.format_exc())
+    pdf.output(pdf_save_path)
+    return pdf.page_no()
+
+
+class FrameStore:
+    """Encoded frames of a catching session, kept in capture order."""
+
+    # frames are image files in the session dir, which save_img_as_pdf can export
+    plain_files = True
+    # put_image() takes the image itself instead of encoded data
+    stores_images = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames: dict[int, tuple] = {}  # seq -> (name, path or bytes)
+        self.total_bytes = 0
+
+    def put(self, seq: int, name: str, data: bytes, encoding: str = None) -> (str, None):
+        """Store a frame, return its path or None if it is kept in memory."""
+        raise NotImplementedError
+
+    def put_image(self, seq: int, name: str, img: Image.Image) -> (str, None):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.frames)
+
+    def has_frames(self) -> bool:
+        return bool(self.frames)
+
+    def names(self) -> list:
+        with self.lock:
+            return [self.frames[seq][0] for seq in sorted(self.frames)]
+
+    def sources(self) -> list:
+        """Path or encoded bytes of every frame, in capture order."""
+        with self.lock:
+            return [self.frames[seq][1] for seq in sorted(self.frames)]
+
+    def read(self, seq: int) -> bytes:
+        source = self.frames[seq][1]
+        if isinstance(source, bytes):
+            return source
+        if isinstance(source, TileFrame):
+            return source.encode()
+        with open(source, "rb") as file:
+            return file.read()
+
+    def stats(self) -> dict:
+        return dict(frames=len(self), bytes=self.total_bytes)
+
+    def close(self):
+        pass
+
+
+def open_lines_for_append(path: str):
+    """
+    Open a file of JSON lines to append to. A last line cut off by a crash is truncated first, otherwise the next
+    line would be joined to it and both would be lost.
+    """
+    if os.path.exists(path):
+        with open(path, "r+b") as file:
+            end = file.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 64 * 1024)
+                file.seek(start)
+                newline = file.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != file.seek(0, os.SEEK_END):
+                file.truncate(end)
+    return open(path, "a", encoding="utf-8")
+
+
+class SessionManifest:
+    """
+    Append-only index of the frames in a session dir, one JSON line per frame with its sequence number, name,
+    monotonic timestamp, size in bytes, format, content hash and the encoding chosen for it, if chosen by content.
+    Export reads it instead of scanning the dir.
+    """
+
+    file_name = "manifest.jsonl"
+
+    def __init__(self, dir_path: str):
+        self.path = os.path.join(dir_path, self.file_name)
+        self.file = None
+        self.lock = threading.Lock()
+
+    def append(self, seq: int, name: str, data: bytes, timestamp: float = None, encoding: str = None):
+        entry = dict(seq=seq, name=name, time=time.monotonic() if timestamp is None else timestamp,
+                     size=len(data), format=os.path.splitext(name)[1].lstrip("."),
+                     hash=hashlib.blake2b(data, digest_size=16).hexdigest())
+        if encoding is not None:
+            entry["encoding"] = encoding
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open_lines_for_append(self.path)
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    @classmethod
+    def exists(cls, dir_path: str) -> bool:
+        path = os.path.join(dir_path, cls.file_name)
+        return os.path.exists(path) and os.path.getsize(path) > 0
+
+    @classmethod
+    def read(cls, dir_path: str) -> list:
+        """Entries in sequence order, a line cut off by a crash is ignored."""
+        entries = {}
+        with open(os.path.join(dir_path, cls.file_name), encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["seq"]] = entry
+        return [entries[seq] for seq in sorted(entries)]
+
+
+class SessionJournal:
+    """
+    session.json of a session dir: where its PDF goes and whether it was exported, so sessions cut off by a
+    crash can be found and exported on the next start.
+    """
+
+    file_name = "session.json"
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        self.path = os.path.join(dir_path, self.file_name)
+        self.data: dict = {}
+
+    def write(self, **fields):
+        self.data.update(fields)
+        with open(self.path + ".part", "w", encoding="utf-8") as file:
+            json.dump(self.data, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".part", self.path)
+
+    @classmethod
+    def load(cls, dir_path: str) -> ("SessionJournal", None):
+        journal = cls(dir_path)
+        try:
+            with open(journal.path, encoding="utf-8") as file:
+                journal.data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return journal
+
+    def frame_count(self) -> int:
+        """Frames in the dir, counted from the manifest lines without parsing them."""
+        for name in (SessionManifest.file_name, TileFrameStore.map_name):
+            path = os.path.join(self.dir_path, name)
+            if os.path.exists(path):
+                count = 0
+                with open(path, "rb") as file:
+                    for block in iter(lambda: file.read(1024 * 1024), b""):
+                        count += block.count(b"\n")
+                return count
+        return 0
+
+    @classmethod
+    def find_unfinished(cls, data_dir_path: str, exclude: tuple = ()) -> list:
+        """Journals of the sessions in `data_dir_path` which were never exported, oldest first."""
+        journals = []
+        if not os.path.isdir(data_dir_path):
+            return journals
+        for entry in os.scandir(data_dir_path):
+            if not entry.is_dir() or entry.path in exclude:
+                continue
+            journal = cls.load(entry.path)
+            if journal is not None and journal.data.get("state") == "catching":
+                journals.append(journal)
+        journals.sort(key=lambda journal: journal.data.get("started", 0))
+        return journals
+
+
+class DiskFrameStore(FrameStore):
+    def __init__(self, dir_path: str):
+        super().__init__()
+        self.dir_path = dir_path
+        self.manifest = SessionManifest(dir_path)
+
+    def put(self, seq: int, name: str, data: bytes, encoding: str = None) -> (str, None):
+        path = os.path.join(self.dir_path, name)
+        # a crash never leaves a cut off frame under its name
+        with open(path + ".part", "wb") as file:
+            file.write(data)
+        os.replace(path + ".part", path)
+        self.manifest.append(seq, name, data, encoding=encoding)
+        with self.lock:
+            self.frames[seq] = (name, path)
+            self.total_bytes += len(data)
+        return path
+
+    def load(self):
+        """Take over the frames already in the dir, to resume a session."""
+        if SessionManifest.exists(self.dir_path):
+            with self.lock:
+                for entry in SessionManifest.read(self.dir_path):
+                    self.frames[entry["seq"]] = (entry["name"], os.path.join(self.dir_path, entry["name"]))
+
+    def close(self):
+        self.manifest.close()
+
+
+class MemoryFrameStore(FrameStore):
+    """Keep frames in memory up to `budget_bytes`, frames past the budget are written to `spill_dir_path`."""
+
+    plain_files = False
+
+    def __init__(self, budget_bytes: int, spill_dir_path: str):
+        super().__init__()
+        self.budget_bytes = budget_bytes
+        self.spill_dir_path = spill_dir_path
+        self.manifest = SessionManifest(spill_dir_path)
+        self.memory_bytes = 0
+        self.spilled = 0
+
+    def put(self, seq: int, name: str, data: bytes, encoding: str = None) -> (str, None):
+        with self.lock:
+            in_memory = self.memory_bytes + len(data) <= self.budget_bytes
+            if in_memory:
+                self.memory_bytes += len(data)
+                self.frames[seq] = (name, data)
+            self.total_bytes += len(data)
+        if in_memory:
+            return None
+        os.makedirs(self.spill_dir_path, exist_ok=True)
+        path = os.path.join(self.spill_dir_path, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        self.manifest.append(seq, name, data, encoding=encoding)
+        with self.lock:
+            self.frames[seq] = (name, path)
+            self.spilled += 1
+        return path
+
+    def stats(self) -> dict:
+        return dict(frames=len(self), bytes=self.total_bytes, memory_bytes=self.memory_bytes, spilled=self.spilled)
+
+    def close(self):
+        self.manifest.close()
+
+
+class TileFrame:
+    """Tile map of one frame in a tile pack, picklable so export processes can rebuild the frame."""
+
+    def __init__(self, pack_path: str, size: tuple, mode: str, tile_size: int, tiles: list, extension: str,
+                 quality: int = 85):
+        self.pack_path = pack_path
+        self.size = tuple(size)
+        self.mode = mode
+        self.tile_size = tile_size
+        # (offset, length) of the PNG of every tile in the pack, row by row
+        self.tiles = tiles
+        self.extension = extension
+        self.quality = quality
+
+    def __repr__(self):
+        return f"TileFrame({self.pack_path!r}, {self.size})"
+
+    def image(self) -> Image.Image:
+        img = Image.new(self.mode, self.size)
+        width, height = self.size
+        positions = [(left, top) for top in range(0, height, self.tile_size)
+                     for left in range(0, width, self.tile_size)]
+        with open(self.pack_path, "rb") as file:
+            for position, (offset, length) in zip(positions, self.tiles):
+                file.seek(offset)
+                img.paste(Image.open(io.BytesIO(file.read(length))), position)
+        return img
+
+    def encode(self) -> bytes:
+        """The frame encoded as it would have been saved without tiles."""
+        return encode_image(self.image(), self.extension, self.quality)
+
+
+class TileFrameStore(FrameStore):
+    """
+    Split frames into `tile_size` tiles and store each distinct tile once as PNG in an append-only pack,
+    plus one tile map per frame. Tiles equal to the tile at the same place in the last frame are not hashed
+    nor encoded again. Export rebuilds the frames and encodes them with `extension` and `quality`.
+    """
+
+    plain_files = False
+    stores_images = True
+    pack_name = "tiles.pack"
+    map_name = "frames.jsonl"
+
+    def __init__(self, dir_path: str, extension: str, quality: int = 85, tile_size: int = 256):
+        super().__init__()
+        self.dir_path = dir_path
+        self.extension = extension
+        self.quality = quality
+        self.tile_size = tile_size
+        self.pack_path = os.path.join(dir_path, self.pack_name)
+        self.pack = open(self.pack_path, "ab")
+        self.map_file = open_lines_for_append(os.path.join(dir_path, self.map_name))
+        self.pack_size = self.pack.tell()
+        self.tile_index: dict[bytes, tuple] = {}  # tile hash -> (offset, length)
+        # last frame: size, mode, pixels and (offset, length) of its tiles
+        self.last_frame: (tuple, None) = None
+        self.tiles_total = 0
+        self.tiles_written = 0
+        if self.pack_size:
+            self.rebuild_index()
+
+    def rebuild_index(self):
+        """Hash the tiles already in the pack of a resumed session, so they are not stored again."""
+        modes = {}
+        for _, frame in self.read_frames(self.dir_path).values():
+            for location in frame.tiles:
+                modes.setdefault(location, frame.mode)
+        with open(self.pack_path, "rb") as file:
+            for (offset, length), mode in modes.items():
+                file.seek(offset)
+                try:
+                    with Image.open(io.BytesIO(file.read(length))) as tile:
+                        pixels = np.asarray(tile if tile.mode == mode else tile.convert(mode))
+                except Exception:
+                    continue
+                self.tile_index[self.tile_key(pixels, mode)] = (offset, length)
+
+    @staticmethod
+    def tile_key(tile: np.ndarray, mode: str) -> bytes:
+        """Tiles of the same bytes but another shape or mode are different tiles."""
+        tile_hash = hashlib.blake2b(f"{mode}{tile.shape}".encode("ascii"), digest_size=16)
+        tile_hash.update(tile.tobytes())
+        return tile_hash.digest()
+
+    def put_image(self, seq: int, name: str, img: Image.Image) -> str:
+        size = img.size
+        pixels = np.asarray(img)
+        tile_size = self.tile_size
+        with self.lock:
+            last_frame = self.last_frame
+        if last_frame is not None and (last_frame[0] != size or last_frame[1] != img.mode):
+            last_frame = None
+        tiles = []
+        index = 0
+        for top in range(0, size[1], tile_size):
+            for left in range(0, size[0], tile_size):
+                tile = pixels[top:top + tile_size, left:left + tile_size]
+                if last_frame is not None and np.array_equal(
+                        tile, last_frame[2][top:top + tile_size, left:left + tile_size]):
+                    tiles.append(last_frame[3][index])
+                else:
+                    tiles.append(self.put_tile(tile, img.mode))
+                index += 1
+        frame = TileFrame(self.pack_path, size, img.mode, tile_size, tiles, self.extension, self.quality)
+        with self.lock:
+            self.frames[seq] = (name, frame)
+            self.last_frame = (size, img.mode, pixels, tiles)
+            self.tiles_total += len(tiles)
+            # tiles reach the pack before the map refers to them
+            self.pack.flush()
+            # same tile map, same content
+            tiles_hash = hashlib.blake2b(json.dumps(tiles).encode("ascii"), digest_size=16).hexdigest()
+            self.map_file.write(json.dumps(dict(seq=seq, name=name, time=time.monotonic(), size=size, mode=img.mode,
+                                                tile_size=tile_size, tiles=tiles, extension=self.extension,
+                                                quality=self.quality, hash=tiles_hash)) + "\n")
+            self.map_file.flush()
+        return self.pack_path
+
+    def put_tile(self, tile: np.ndarray, mode: str) -> tuple:
+        tile_hash = self.tile_key(tile, mode)
+        with self.lock:
+            location = self.tile_index.get(tile_hash)
+        if location is not None:
+            return location
+        buffer = io.BytesIO()
+        Image.fromarray(tile, mode).save(buffer, format="PNG", compress_level=1)
+        data = buffer.getvalue()
+        with self.lock:
+            location = self.tile_index.get(tile_hash)
+            if location is None:
+                self.pack.write(data)
+                location = (self.pack_size, len(data))
+                self.pack_size += len(data)
+                self.tile_index[tile_hash] = location
+                self.tiles_written += 1
+                self.total_bytes += len(data)
+        return location
+
+    def sources(self) -> list:
+        with self.lock:
+            self.pack.flush()
+        return super().sources()
+
+    def close(self):
+        with self.lock:
+            self.pack.close()
+            self.map_file.close()
+            self.last_frame = None
+
+    def stats(self) -> dict:
+        return dict(frames=len(self), bytes=self.total_bytes, tiles=self.tiles_total, tiles_written=self.tiles_written)
+
+    @classmethod
+    def is_tile_dir(cls, dir_path: str) -> bool:
+        return os.path.exists(os.path.join(dir_path, cls.map_name))
+
+    @classmethod
+    def read_frames(cls, dir_path: str) -> dict:
+        """seq -> (name, TileFrame) of every frame stored in `dir_path`, a line cut off by a crash is ignored."""
+        frames = {}
+        with open(os.path.join(dir_path, cls.map_name), encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                frames[entry["seq"]] = (entry["name"], TileFrame(
+                    os.path.join(dir_path, cls.pack_name), entry["size"], entry["mode"], entry["tile_size"],
+                    [tuple(tile) for tile in entry["tiles"]], entry["extension"], entry["quality"]))
+        return frames
+
+    @classmethod
+    def load_frames(cls, dir_path: str) -> list:
+        """TileFrame of every frame stored in `dir_path`, in capture order."""
+        frames = cls.read_frames(dir_path)
+        return [frames[seq][1] for seq in sorted(frames)]
+
+    def load(self):
+        """Take over the frames already in the dir, to resume a session."""
+        with self.lock:
+            self.frames.update(self.read_frames(self.dir_path))
+
+
 class Main:
     def __init__(self):
         self.pdf_default_extension = ".pdf"
@@ -127,6 +2526,9 @@ class Main:
         self.shortcuts_keys = ['v']  # settable
         self.shortcuts_callbacks = [self.screenshot]
         self.stop_shortcut = "Esc"
+        self.stop_press_time: float = 1
+        # None: global hook of the keyboard module
+        self.hotkey_backend: (HotkeyBackend, None) = None
         # Screenshot Notification
         self.screenshot_notification_enable = True
         # img quality in pdf
@@ -134,20 +2536,99 @@ class Main:
         self.img_quality_max: int = 100
         self.img_quality_min: int = 10
         self.img_quality_step: int = 1
+        # "auto": indexed PNG, PNG or JPEG at img_quality for each screenshot by its content,
+        # "quality": JPEG below img_quality 95, PNG from 95
+        self.img_format: str = "auto"  # settable
+        # capture pipeline
+        self.capture_workers: int = 2  # settable
+        self.capture_queue_size: int = 8  # settable
+        # add pages to the PDF while catching, stopping only finishes the file,
+        # not with session_storage "memory", which writes nothing until the PDF is saved
+        self.pdf_streaming_enable = True  # settable
+        # crop off the borders which stay the same on every screenshot of a session when saving the PDF,
+        # pages are then not streamed into the PDF while catching
+        self.crop_borders_enable = False  # settable
+        self.crop_borders_padding: int = 16  # settable
+        # False: one crop box for screenshots of every size
+        self.crop_borders_per_monitor = True  # settable
+        self.pdf_writer: (PDFWriter, None) = None
+        # split PDFs into volumes "<name>-001.pdf", ... past this many pages or MiB, 0: no limit
+        self.pdf_volume_pages: int = 0  # settable
+        self.pdf_volume_mb: int = 0  # settable
+        # downscale PDF pages to fit this many pixels or to this DPI, 0: native size, see ExportScale
+        self.export_max_width: int = 0  # settable
+        self.export_max_height: int = 0  # settable
+        self.export_dpi: float = 0  # settable
+        # DPI of the screenshots, 192 on a 200% display
+        self.screen_dpi: float = 96  # settable
+        self.export_scale: (ExportScale, None) = None
+        # "full": primary screen, "active_window", "region": capture_region or "monitor": capture_monitor
+        self.capture_mode: str = "full"  # settable
+        self.capture_region: (list, None) = None  # settable, [left, top, width, height]
+        self.capture_monitor: int = 0  # settable
+        self.capture_fixed_region: (tuple, None) = None
+        # "auto", "pyautogui", "xshm" or "synthetic"
+        self.grab_backend: str = "auto"  # settable
+        self.screen_backend: (ScreenBackend, None) = None
+        # keep grabbing into a ring, a screenshot takes the frame closest to the key press
+        self.precapture_enable = False  # settable
+        self.precapture_fps: float = 4  # settable
+        self.precapture_frames: int = 8  # settable
+        self.precapture_max_memory_mb: int = 256  # settable
+        self.precapture_buffer: (PreCaptureBuffer, None) = None
+        # take screenshots when the screen changes, alongside the hotkeys
+        self.auto_capture_enable = False  # settable
+        # fraction of changed pixels which triggers a screenshot
+        self.auto_capture_threshold: float = 0.02  # settable
+        self.auto_capture_min_interval: float = 2  # settable
+        # screenshot anyway after this many seconds without one, 0: only on change
+        self.auto_capture_max_interval: float = 0  # settable
+        self.auto_capture_sample_interval: float = 0.5  # settable
+        self.auto_capture_scheduler: (AutoCaptureScheduler, None) = None
+        # duplicate screenshots: "off", "mark" (keep and log) or "skip"
+        self.duplicate_mode: str = "mark"  # settable
+        # max differing bits of the 64 bits difference hash
+        self.duplicate_threshold: int = 0  # settable
+        self.duplicate_filter: (DuplicateFilter, None) = None
+        # "disk": screenshots go to the session dir, "memory": kept in memory until the PDF is saved,
+        # screenshots past session_memory_mb are written to the session dir,
+        # "tiles": only the changed tiles of each screenshot go to the session dir
+        self.session_storage: str = "disk"  # settable
+        self.session_memory_mb: int = 1024  # settable
+        self.frame_store: (FrameStore, None) = None
+        self.session_journal: (SessionJournal, None) = None
+        # look for sessions cut off by a crash on start
+        self.recovery_enable = True  # settable
+        # processes preparing images on export, 0: one per core
+        self.export_workers: int = 0  # settable
         self.pdf_to_clipboard = True
         self.save_pdf_dir_path = None
         self.pdf_save_name = None
         self.pdf_save_path = None
-        self.key_listener_thread = None
-        self.stop_listener_thread = None
-        self.screenshot_thread = None
+        self.hotkey_dispatcher: (HotkeyDispatcher, None) = None
+        self.capture_pipeline: (CapturePipeline, None) = None
+        # True while a stopped session waits for its capture threads, a new one can start after
+        self.stopping = False
+        # PDFs of stopped sessions are saved in the background, one after another
+        self.export_queue = ExportQueue()
+        # stage timings and counters of the current or last session
+        self.metrics = Metrics()
+        # write the metrics of each session to METRICS_DIR
+        self.metrics_dump_enable = True  # settable
+        # lines kept in the log box
+        self.log_max_lines: int = 5000  # settable
+        # at most one notification every notification_interval seconds, screenshots in between are merged
+        self.notification_interval: float = 2  # settable
+        self.notification_dispatcher: (NotificationDispatcher, None) = None
         # theme
         self.app_theme: (None, str) = "dark_lightgreen"  # settable
-        self.app_theme_list: list[str] = ["None"] + list(qt_material.list_themes())
         self.main_ui: ScreenCatcherGUI = ScreenCatcherGUI(self)
+        self.export_queue.on_update = self.main_ui.export_updated.emit
         self.setting_manager = SettingsManager(self.main_ui, self)
         self.main_ui.show()
         self.set_theme()
+        if self.recovery_enable:
+            threading.Thread(target=self.find_unfinished_sessions, daemon=True).start()
 
     def main_init(self):
         self.catching_state = False
@@ -155,9 +2636,17 @@ class Main:
         self.save_pdf_dir_path = None
         self.pdf_save_name = None
         self.pdf_save_path = None
-        self.key_listener_thread = None
-        self.stop_listener_thread = None
-        self.screenshot_thread = None
+        self.hotkey_dispatcher = None
+        self.capture_pipeline = None
+        self.pdf_writer = None
+        self.duplicate_filter = None
+        self.capture_fixed_region = None
+        self.precapture_buffer = None
+        self.auto_capture_scheduler = None
+        self.notification_dispatcher = None
+        self.frame_store = None
+        self.session_journal = None
+        self.export_scale = None
 
     @staticmethod
     def current_time_str(year=True, month=True, day=True, hour=True, minute=True, second=True, microsecond=True) -> str:
@@ -177,7 +2666,7 @@ class Main:
         if second:
             components.append(f"{now.second:02d}")
         if microsecond:
-            components.append(f"{now.microsecond}")
+            components.append(f"{now.microsecond:06d}")
 
         formatted_time = ".".join(components)
         return formatted_time
@@ -193,15 +2682,10 @@ class Main:
         else:
             return ".png"
 
-    def has_img_with_extension(self, extension: str, dir_path: str = None):
-        if dir_path is None:
-            dir_path = self.save_img_dir_path
-        if not os.path.isdir(dir_path):
-            raise ValueError(f"Path\"{dir_path}\" no found")
-        for filename in os.listdir(dir_path):
-            if filename.endswith(extension):
-                return True
-        return False
+    @property
+    def frame_extension(self) -> str:
+        """Extension to encode screenshots with, "auto" if it is chosen for each one."""
+        return "auto" if self.img_format == "auto" else self.img_extension
 
     def set_pdf_path(self, pdf_path=None, pdf_dir_path=None, pdf_name=None):
         if pdf_path is not None:
@@ -238,92 +2722,226 @@ class Main:
         else:
             return None
 
-    def screenshot(self, save_dir_path: str = None, save_img_name: str = None):
+    def screenshot(self, press_time: float = None, save_dir_path: str = None, save_img_name: str = None) -> bool:
         if save_dir_path is None:
             save_dir_path = self.save_img_dir_path
         if save_img_name is None:
             save_img_name = self.current_time_str()
         save_img_path = os.path.join(save_dir_path, save_img_name + self.img_extension)
-
-        @Threaded
-        def screenshot_and_save():
-            img: Image.Image = pyautogui.screenshot()
-            output(f"Screenshot \"{save_img_name + self.img_extension}\"")
-            if self.screenshot_notification_enable:
-                self.main_ui.show_notification(
-                    message=f"Screenshot \"{save_img_name + self.img_extension}\"",
-                    title="",
-                )
-            if self.img_extension == ".jpg":
-                img.save(save_img_path, quality=self.img_quality, optimize=True)
-            elif self.img_extension == ".png":
-                img.save(save_img_path)
-            output(f"Save screenshot to \"{save_img_path}\"")
-            return img
-
-        self.screenshot_thread = screenshot_and_save()
-        return self.screenshot_thread
-
-    def save_img_as_pdf(self, img_dir_path: str, pdf_save_path: str = None):
-        if pdf_save_path is None:
-            pdf_save_path: str = os.path.join(img_dir_path, f"{self.current_time_str()}{self.pdf_default_extension}")
-        pdf = FPDF(unit="pt")
-        pdf.set_auto_page_break(False)  # 自动分页设为False
-        image_list = list(os.listdir(img_dir_path))
-        for img_name in image_list:
-            if not img_name.endswith(self.img_extension):
-                continue
+        if self.capture_pipeline is None:
+            output("Warning: Screenshot is only available in catching")
+            return False
+        if press_time is not None:
+            # key press to screenshot request
+            self.metrics.record("hotkey", max(0.0, time.time() - press_time))
+        return self.capture_pipeline.submit(CaptureFrame(name=save_img_name + self.img_extension, path=save_img_path,
+                                                         request_time=press_time))
+
+    def get_screen_backend(self) -> ScreenBackend:
+        if self.screen_backend is None:
             try:
-                img_path = os.path.join(img_dir_path, img_name)
-                img = Image.open(img_path)
-                width, height = img.size
-                # noinspection PyTypeChecker
-                pdf.add_page(format=(width, height))
-                pdf.image(img, x=0, y=0, w=width, h=height)  # 指定宽高
+                self.screen_backend = create_screen_backend(self.grab_backend)
             except Exception:
                 output(traceback.format_exc())
-        pdf.output(pdf_save_path)
+                output(f"Warning: Screen backend\"{self.grab_backend}\" not available, use pyautogui")
+                self.screen_backend = PyAutoGUIScreenBackend()
+        return self.screen_backend
+
+    def resolve_capture_region(self) -> (tuple, None):
+        """Region to grab for the current capture mode, None for the whole primary screen."""
+        screen = self.get_screen_backend()
+        if self.capture_mode == "active_window":
+            region = screen.active_window_rect()
+        elif self.capture_mode == "region":
+            region = self.capture_region
+        elif self.capture_mode == "monitor":
+            monitors = screen.monitors()
+            region = monitors[self.capture_monitor] if 0 <= self.capture_monitor < len(monitors) else None
+        else:
+            region = None
+        if region is None:
+            return None
+        return intersect_rect(tuple(region), screen.desktop_rect())
 
-    @Threaded
-    def key_listener(self):
+    def grab_screen(self) -> (Image.Image, tuple):
+        if self.capture_mode == "active_window":
+            region = self.resolve_capture_region()
+        else:
+            region = self.capture_fixed_region
+        return self.get_screen_backend().grab(region), region
+
+    def grab_frame(self, frame: CaptureFrame) -> (Image.Image, None):
+        pre_captured = None
+        if self.precapture_buffer is not None:
+            pre_captured = self.precapture_buffer.take(frame.request_time)
+        self.metrics.gauge("queue_depth", self.capture_pipeline.queue_depth)
+        if pre_captured is None:
+            with self.metrics.timer("grab"):
+                img, frame.region = self.grab_screen()
+        else:
+            img, frame.region, frame_time = pre_captured
+            frame.press_offset = frame_time - frame.request_time
+            output(f"Screenshot \"{frame.name}\" taken {frame.press_offset * 1000:+.0f} ms from the key press")
+        if self.duplicate_filter is not None:
+            frame.hash, frame.duplicate = self.duplicate_filter.check(img)
+            if frame.duplicate and self.duplicate_mode == "skip":
+                output(f"Screenshot \"{frame.name}\" skipped, same as the previous one")
+                return None
+        if frame.duplicate:
+            output(f"Screenshot \"{frame.name}\" (duplicate)")
+        else:
+            output(f"Screenshot \"{frame.name}\"")
+        if self.notification_dispatcher is not None:
+            self.notification_dispatcher.notify(f"Screenshot \"{frame.name}\"")
+        return img
+
+    def send_notification(self, message: str):
+        with self.metrics.timer("notification"):
+            self.main_ui.show_notification(message=message, title="")
+
+    def encode_frame_data(self, frame: CaptureFrame) -> (bytes, str):
+        """Encode the frame by img_format, return (data, extension)."""
+        extension = os.path.splitext(frame.name)[1]
+        with self.metrics.timer("encode"):
+            if self.img_format != "auto":
+                return encode_image(frame.image, extension, self.img_quality), extension
+            data, extension, frame.encoding = encode_image_auto(frame.image, self.img_quality)
+        self.metrics.count(f"encoding_{frame.encoding}")
+        return data, extension
+
+    def encode_frame(self, frame: CaptureFrame):
+        extension = os.path.splitext(frame.name)[1]
+        data = None
+        if self.frame_store.stores_images:
+            stored_bytes = self.frame_store.total_bytes
+            with self.metrics.timer("write"):
+                frame.path = self.frame_store.put_image(frame.seq, frame.name, frame.image)
+            self.metrics.count("bytes", self.frame_store.total_bytes - stored_bytes)
+        else:
+            data, extension = self.encode_frame_data(frame)
+            frame.name = os.path.splitext(frame.name)[0] + extension
+            with self.metrics.timer("write"):
+                frame.path = self.frame_store.put(frame.seq, frame.name, data, encoding=frame.encoding)
+            self.metrics.count("bytes", len(data))
+        self.metrics.count("frames")
+        if frame.path is None:
+            output(f"Keep screenshot \"{frame.name}\" in memory")
+        else:
+            output(f"Save screenshot to \"{frame.path}\"")
+        if self.pdf_writer is not None:
+            size, page_size = frame.image.size, None
+            if self.export_scale is not None and self.export_scale.active:
+                size, page_size = self.export_scale.fit(*frame.image.size)
+            if data is None and size == frame.image.size:
+                data, extension = self.encode_frame_data(frame)
+            with self.metrics.timer("pdf_page"):
+                if size != frame.image.size:
+                    pdf_image = PDFImage.from_bytes(encode_image(resample_image(frame.image, size),
+                                                                 self.frame_extension, self.img_quality))
+                elif extension == ".jpg":
+                    pdf_image = PDFImage.from_jpeg(data, *frame.image.size, components=len(frame.image.getbands()))
+                else:
+                    pdf_image = PDFImage.from_png_bytes(data) or PDFImage.from_image(frame.image)
+                pdf_image.page_size = page_size
+                self.pdf_writer.add_page(pdf_image, seq=frame.seq)
+
+    def discard_frame(self, frame: CaptureFrame):
+        if self.pdf_writer is not None:
+            self.pdf_writer.skip(frame.seq)
+
+    def find_unfinished_sessions(self):
+        """Runs in a thread, the GUI asks what to do with the sessions found."""
         try:
-            keys = self.shortcuts_keys
-            callbacks_list: list = self.shortcuts_callbacks
-            callbacks_state: list = [False] * len(callbacks_list)
-            output("key_listener ON")
-            while True:
-                if not self.catching_state:
-                    output("key_listener OFF")
-                    return
-                index = 0
-                for key, callback in zip(keys, callbacks_list):
-                    if keyboard.is_pressed(key):
-                        if callbacks_state[index] is False:
-                            callbacks_state[index] = True
-                            callback()
-                    elif callbacks_state[index] is True:
-                        callbacks_state[index] = False
-                    index += 1
+            journals = SessionJournal.find_unfinished(self.img_create_dir_path, exclude=(self.save_img_dir_path,))
+            if journals:
+                # counting reads every manifest, not on the GUI thread
+                frames = [journal.frame_count() for journal in journals]
+                self.main_ui.unfinished_sessions_found.emit(journals, frames)
         except Exception:
-            print(traceback.format_exc())
+            output(traceback.format_exc())
 
-    @Threaded
-    def stop_listener(self, stop_shortcut: str = None, press_time: int = 1):
-        if stop_shortcut is None:
-            stop_shortcut = self.stop_shortcut
-        # 长按 press_time 秒后触发回调函数
-        esc_pressed_time = 0
-        while True:
-            if not self.catching_state:
-                return
-            if keyboard.is_pressed(stop_shortcut):
-                if esc_pressed_time == 0:
-                    esc_pressed_time = time.time()
-                elif time.time() - esc_pressed_time >= press_time:
-                    break
+    def export_unfinished_sessions(self, journals: list):
+        """Queue the export of sessions cut off by a crash to their PDF path."""
+        for journal in journals:
+            self.export_queue.submit(ExportJob(os.path.basename(journal.dir_path),
+                                               lambda job, journal=journal: self.recover_session(job, journal),
+                                               options=self.export_options()))
+
+    def recover_session(self, job: ExportJob, journal: SessionJournal):
+        pdf_save_path = journal.data.get("pdf_save_path")
+        if pdf_save_path:
+            # pages streamed while catching stopped with the crash
+            remove_pdf_part(pdf_save_path)
+        if not pdf_save_path or not os.path.isdir(os.path.dirname(pdf_save_path)):
+            pdf_save_path = journal.dir_path.rstrip(os.sep) + self.pdf_default_extension
+        if os.path.exists(pdf_save_path):
+            # do not overwrite what was saved there since
+            pdf_save_path = f"{os.path.splitext(pdf_save_path)[0]} (recovered){self.pdf_default_extension}"
+        output(f"Recovering \"{journal.dir_path}\"")
+        pages = save_session_as_pdf(journal.dir_path, pdf_save_path, progress=job.progress, **job.options)
+        journal.write(state="exported", exported=time.time(), pdf_save_path=pdf_save_path)
+        output(f"PDF\"{pdf_save_path}\" saved, {pages} pages recovered")
+
+    def discard_unfinished_sessions(self, journals: list):
+        # the screenshots stay in the dir, the session is only no longer offered
+        for journal in journals:
+            if journal.data.get("pdf_save_path"):
+                remove_pdf_part(journal.data["pdf_save_path"])
+            journal.write(state="discarded")
+
+    def create_capture_pipeline(self, first_seq: int = 0) -> CapturePipeline:
+        if self.capture_mode in ("region", "monitor"):
+            self.capture_fixed_region = self.resolve_capture_region()
+            if self.capture_fixed_region is None:
+                output(f"Warning: No {self.capture_mode} to capture, capture the full screen")
             else:
-                esc_pressed_time = 0
-        self.catching_stop(check_stop_listener=False)
+                output(f"Capture {self.capture_mode} {self.capture_fixed_region}")
+        else:
+            self.capture_fixed_region = None
+        if self.duplicate_mode in ("mark", "skip"):
+            self.duplicate_filter = DuplicateFilter(threshold=self.duplicate_threshold)
+        else:
+            self.duplicate_filter = None
+        return CapturePipeline(grab=self.grab_frame, encode=self.encode_frame, discard=self.discard_frame,
+                               workers=self.capture_workers, queue_size=self.capture_queue_size, first_seq=first_seq)
+
+    def create_export_scale(self) -> ExportScale:
+        return ExportScale(max(0, self.export_max_width), max(0, self.export_max_height), max(0, self.export_dpi),
+                           self.screen_dpi, self.img_quality)
+
+    def create_border_crop(self) -> (BorderCrop, None):
+        if not self.crop_borders_enable:
+            return None
+        return BorderCrop(self.crop_borders_padding, per_monitor=self.crop_borders_per_monitor)
+
+    def pdf_volume_limits(self) -> dict:
+        return dict(max_pages=max(0, self.pdf_volume_pages), max_bytes=max(0, int(self.pdf_volume_mb * 1024 * 1024)))
+
+    def export_options(self) -> dict:
+        """Export settings as keyword arguments of save_session_as_pdf, taken as they are now."""
+        return dict(workers=self.export_workers, scale=self.create_export_scale(), crop=self.create_border_crop(),
+                    **self.pdf_volume_limits())
+
+    def save_img_as_pdf(self, img_dir_path: str, pdf_save_path: str = None, passthrough: bool = True,
+                        progress: Callable[[int, int], Any] = None, volumes: list = None,
+                        options: dict = None) -> int:
+        if pdf_save_path is None:
+            pdf_save_path: str = os.path.join(img_dir_path, f"{self.current_time_str()}{self.pdf_default_extension}")
+        if options is None:
+            options = self.export_options()
+        return save_session_as_pdf(img_dir_path, pdf_save_path, passthrough=passthrough, progress=progress,
+                                   volumes=volumes, **options)
+
+    def create_hotkey_dispatcher(self, backend: HotkeyBackend = None) -> HotkeyDispatcher:
+        if backend is None:
+            backend = self.hotkey_backend
+        dispatcher = HotkeyDispatcher(backend)
+        for key, callback in zip(self.shortcuts_keys, self.shortcuts_callbacks):
+            # screenshot gets the time of the key press
+            dispatcher.bind(key, callback, with_time=callback == self.screenshot)
+        # 长按 stop_press_time 秒后停止捕捉
+        dispatcher.bind_long_press(self.stop_shortcut, self.catching_stop, press_time=self.stop_press_time)
+        return dispatcher
 
     def create_tem_img_dir(self, name: str = None, path: str = None):
         if name is None:
@@ -343,67 +2961,244 @@ class Main:
             self.main_ui.update_path_line()
         return self.pdf_save_path
 
-    def catching_start(self) -> bool:
+    def catching_start(self, resume_journal: SessionJournal = None) -> bool:
         if self.catching_state:
             output('Warning: Already in catching!')
             return False
+        if self.stopping:
+            output('Warning: The last catching is still stopping!')
+            return False
+        if resume_journal is not None and resume_journal.data.get("pdf_save_path"):
+            self.set_pdf_path(resume_journal.data["pdf_save_path"])
+            self.main_ui.update_path_line()
         if self.pdf_save_path is None:
             self.select_pdf_save_path()
         if self.pdf_save_path is None:
             return False
-        self.save_img_dir_path = self.create_tem_img_dir()
+        self.metrics = Metrics()
+        if self.screenshot_notification_enable:
+            self.notification_dispatcher = NotificationDispatcher(
+                self.send_notification, min_interval=self.notification_interval,
+                merge=lambda messages: f"{len(messages)} screenshots captured")
+            self.notification_dispatcher.start()
+        first_seq = 0
+        if resume_journal is not None:
+            # keep adding to the dir, the PDF is exported from it at the end
+            self.save_img_dir_path = resume_journal.dir_path
+            if resume_journal.data.get("storage") == "tiles":
+                self.frame_store = TileFrameStore(self.save_img_dir_path, resume_journal.data["img_extension"],
+                                                  resume_journal.data.get("img_quality", self.img_quality))
+            else:
+                self.frame_store = DiskFrameStore(self.save_img_dir_path)
+            self.frame_store.load()
+            first_seq = max(self.frame_store.frames, default=-1) + 1
+            self.session_journal = resume_journal
+            output(f"Resume \"{self.save_img_dir_path}\" with {len(self.frame_store)} screenshots")
+        elif self.session_storage == "memory":
+            # the dir is only created if screenshots spill out of memory, the PDF is written from memory at stop
+            self.save_img_dir_path = os.path.join(self.img_create_dir_path, self.current_time_str())
+            self.frame_store = MemoryFrameStore(self.session_memory_mb * 1024 * 1024, self.save_img_dir_path)
+        else:
+            self.save_img_dir_path = self.create_tem_img_dir()
+            if self.session_storage == "tiles":
+                self.frame_store = TileFrameStore(self.save_img_dir_path, self.frame_extension, self.img_quality)
+            else:
+                self.frame_store = DiskFrameStore(self.save_img_dir_path)
+            if self.pdf_streaming_enable and not self.crop_borders_enable:
+                # stopping only writes the trailer and renames the PDF, nothing left to copy
+                self.pdf_writer = PDFWriter(self.pdf_save_path, atomic=True, **self.pdf_volume_limits())
+            self.session_journal = SessionJournal(self.save_img_dir_path)
+        if self.session_journal is not None:
+            # screenshots kept in memory are lost with the process anyway, only dirs get a journal
+            self.session_journal.write(state="catching", pdf_save_path=self.pdf_save_path, version=__version__,
+                                       storage="tiles" if isinstance(self.frame_store, TileFrameStore) else "disk",
+                                       img_extension=self.frame_extension, img_quality=self.img_quality,
+                                       started=self.session_journal.data.get("started", time.time()))
+        if self.pdf_writer is not None:
+            # pages streamed into the PDF are scaled as they come
+            self.export_scale = self.create_export_scale()
+        self.capture_pipeline = self.create_capture_pipeline(first_seq=first_seq)
+        self.capture_pipeline.start()
+        if self.precapture_enable:
+            self.precapture_buffer = PreCaptureBuffer(
+                grab=self.grab_screen, fps=min(self.precapture_fps, 30), max_frames=self.precapture_frames,
+                max_bytes=self.precapture_max_memory_mb * 1024 * 1024)
+            self.precapture_buffer.start()
         self.catching_state = True
         output("Catching start")
-        # 启动键盘监听线程
-        self.key_listener_thread: Threaded.ThreadedResult = self.key_listener(self)
-        self.stop_listener_thread: Threaded.ThreadedResult = self.stop_listener(self)
+        if self.auto_capture_enable:
+            self.auto_capture_scheduler = AutoCaptureScheduler(
+                grab=self.grab_screen, capture=self.screenshot, threshold=self.auto_capture_threshold,
+                min_interval=self.auto_capture_min_interval, max_interval=self.auto_capture_max_interval,
+                sample_interval=self.auto_capture_sample_interval)
+            self.auto_capture_scheduler.start()
+            output("Auto capture ON")
+        # 启动键盘监听
+        self.hotkey_dispatcher = self.create_hotkey_dispatcher()
+        self.hotkey_dispatcher.start()
+        output("Hotkey listener ON")
         return True
 
-    def catching_stop(self, check_key_listener=True, check_stop_listener=True, check_screenshot=True) -> bool:
+    def catching_stop(self) -> bool:
+        """Stop catching, the capture threads are stopped and the PDF is saved in the background."""
         if self.catching_state is False:
             output('Warning: No current catching!')
             return False
         self.catching_state = False
-        if self.key_listener_thread is not None and check_key_listener:
-            self.key_listener_thread.thread.join(15)
-        if self.stop_listener_thread is not None and check_stop_listener:
-            self.stop_listener_thread.thread.join(15)
-        if self.screenshot_thread is not None and check_screenshot:
-            self.screenshot_thread.thread.join(15)
-        output('Stop catching')
-        if self.has_img_with_extension(self.img_extension):
-            self.save_pdf()
-            if self.pdf_to_clipboard:
-                self.copy_file_to_clipboard()
-        else:
-            output(f"Saving: No img file found in \"{self.save_img_dir_path}\"")
-            output("No PDF saved")
-        self.main_init()
-        self.main_ui.update_path_line()
+        self.stopping = True
+        threading.Thread(target=self.finish_catching, daemon=True).start()
         return True
 
-    def save_pdf(self, img_dir_path: str = None, pdf_save_path: str = None):
-        if img_dir_path is None:
-            img_dir_path = self.save_img_dir_path
-        if pdf_save_path is None:
-            pdf_save_path = self.pdf_save_path
-        original_pdf_save_path = os.path.join(self.save_img_dir_path, self.current_time_str() + ".pdf")
-        self.save_img_as_pdf(img_dir_path=img_dir_path, pdf_save_path=original_pdf_save_path)
-        output(f"PDF\"{original_pdf_save_path}\" saved")
-        shutil.copy(original_pdf_save_path, pdf_save_path)
-        output(f"PDF\"{pdf_save_path}\" saved")
-
-    def copy_file_to_clipboard(self, file_path: str = None):
+    def finish_catching(self):
+        """Wait for the capture threads, then hand the session to the export queue and get ready for the next."""
+        job = None
+        try:
+            if self.auto_capture_scheduler is not None:
+                self.auto_capture_scheduler.stop(15)
+                stats = self.auto_capture_scheduler.stats()
+                output(f"Auto capture OFF: {stats['captured']} screenshots from {stats['sampled']} samples, "
+                       f"sample time {stats['mean_sample_time'] * 1000:.1f} ms")
+            if self.hotkey_dispatcher is not None:
+                self.hotkey_dispatcher.stop(15)
+                output("Hotkey listener OFF")
+            if self.capture_pipeline is not None:
+                # 等待所有截图写入磁盘
+                stats = self.capture_pipeline.stop()
+                output(f"Screenshots: {stats['encoded']} saved, {stats['skipped']} skipped, "
+                       f"{stats['dropped']} dropped, {stats['failed']} failed, "
+                       f"max queue depth {stats['max_queue_depth']}")
+            if self.duplicate_filter is not None:
+                stats = self.duplicate_filter.stats()
+                output(f"Duplicates: {stats['duplicates']} of {stats['hashed']} screenshots, "
+                       f"hash time {stats['mean_hash_time'] * 1000:.2f} ms per screenshot")
+            if self.precapture_buffer is not None:
+                self.precapture_buffer.stop(15)
+            if self.notification_dispatcher is not None:
+                self.notification_dispatcher.stop(5)
+            if isinstance(self.frame_store, MemoryFrameStore):
+                stats = self.frame_store.stats()
+                output(f"Memory: {stats['memory_bytes'] / 1024 / 1024:.1f} MiB of screenshots, "
+                       f"{stats['spilled']} written to \"{self.save_img_dir_path}\"")
+            elif isinstance(self.frame_store, TileFrameStore):
+                stats = self.frame_store.stats()
+                output(f"Tiles: {stats['tiles_written']} of {stats['tiles']} tiles written, "
+                       f"{stats['bytes'] / 1024 / 1024:.1f} MiB")
+            output('Stop catching')
+            # the job keeps the session, Main is free for the next one
+            session = dict(img_dir_path=self.save_img_dir_path, pdf_save_path=self.pdf_save_path,
+                           frame_store=self.frame_store, pdf_writer=self.pdf_writer,
+                           session_journal=self.session_journal, metrics=self.metrics)
+            job = ExportJob(os.path.basename(self.pdf_save_path),
+                            lambda job: self.export_catching(job, **session), options=self.export_options())
+        except Exception:
+            output(traceback.format_exc())
+        self.main_init()
+        if job is not None:
+            self.export_queue.submit(job)
+        self.stopping = False
+        self.main_ui.catching_stopped.emit()
+
+    def export_catching(self, job: ExportJob, img_dir_path: str, pdf_save_path: str, frame_store: FrameStore,
+                        pdf_writer: (PDFWriter, None), session_journal: (SessionJournal, None), metrics: Metrics):
+        """Save the PDF of a stopped session, runs in the export queue."""
+        try:
+            if frame_store.has_frames():
+                with metrics.timer("pdf_finalize"):
+                    pdf_save_paths = self.save_pdf(img_dir_path, pdf_save_path, frame_store, pdf_writer, job)
+                if session_journal is not None:
+                    session_journal.write(state="exported", exported=time.time())
+                if self.pdf_to_clipboard:
+                    # the clipboard belongs to the GUI thread, returns once it is copied
+                    self.main_ui.clipboard_requested.emit(pdf_save_paths, metrics)
+            else:
+                if session_journal is not None:
+                    session_journal.write(state="empty")
+                output(f"Saving: No screenshot in \"{img_dir_path}\"")
+                output("No PDF saved")
+                if pdf_writer is not None:
+                    pdf_writer.discard()
+        except ExportCancelled:
+            if pdf_writer is not None:
+                pdf_writer.discard()
+            if frame_store.plain_files or isinstance(frame_store, TileFrameStore):
+                # the journal stays "catching", the session is offered again on the next start
+                output(f"No PDF saved, screenshots kept in \"{img_dir_path}\"")
+            else:
+                output("No PDF saved, screenshots in memory are dropped")
+            raise
+        finally:
+            frame_store.close()
+            if self.metrics_dump_enable:
+                self.dump_metrics(metrics=metrics)
+
+    def wait_exports(self):
+        """Keep the GUI responsive until the stopping session and all exports are done."""
+        while self.stopping or self.export_queue.busy():
+            app.processEvents()
+            self.export_queue.wait(0.05)
+
+    def dump_metrics(self, path: str = None, metrics: Metrics = None):
+        if path is None:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{self.current_time_str()}.json")
+        if metrics is None:
+            metrics = self.metrics
+        try:
+            metrics.dump(path)
+            output(f"Metrics \"{path}\" saved")
+        except Exception:
+            output(traceback.format_exc())
+
+    def save_pdf(self, img_dir_path: str, pdf_save_path: str, frame_store: FrameStore = None,
+                 pdf_writer: PDFWriter = None, job: ExportJob = None) -> list:
+        """Return the path of every PDF saved, more than one if the PDF is split into volumes."""
+        progress = job.progress if job is not None else None
+        # the settings of when the session was stopped, not of when its job runs
+        options = job.options if job is not None else self.export_options()
+        pdf_save_paths = []
+        if pdf_writer is not None:
+            # pages were added while catching, only the trailer is left to write
+            if job is not None:
+                job.progress(pdf_writer.page_count, pdf_writer.page_count)
+            pdf_writer.close()
+            if pdf_writer.shared_images:
+                output(f"{pdf_writer.shared_images} of {pdf_writer.page_count} pages reuse the image of "
+                       f"an earlier page")
+            if len(pdf_writer.paths) > 1:
+                output(f"PDF\"{pdf_writer.path}\" split into {len(pdf_writer.paths)} volumes")
+            pdf_save_paths = pdf_writer.paths
+        elif frame_store is not None and not frame_store.plain_files:
+            # write straight from memory or tiles to the destination
+            options = dict(options)
+            if isinstance(frame_store, TileFrameStore) and options.get("scale") is not None:
+                options["scale"] = options["scale"].with_cache(os.path.join(img_dir_path, ExportScale.cache_name))
+            save_img_paths_as_pdf(frame_store.sources(), pdf_save_path, progress=progress,
+                                  volumes=pdf_save_paths, **options)
+        else:
+            self.save_img_as_pdf(img_dir_path=img_dir_path, pdf_save_path=pdf_save_path,
+                                 progress=progress, volumes=pdf_save_paths, options=options)
+        for path in pdf_save_paths:
+            output(f"PDF\"{path}\" saved")
+        return pdf_save_paths
+
+    def copy_file_to_clipboard(self, file_path: (str, list) = None, metrics: Metrics = None):
         if file_path is None:
             file_path = self.pdf_save_path
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"\"{file_path}\" no found")
+        if metrics is None:
+            metrics = self.metrics
+        file_paths = file_path if isinstance(file_path, list) else [file_path]
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"\"{file_path}\" no found")
+        clipboard_start = time.perf_counter()
         clipboard = QApplication.clipboard()
-        url_list = [pyqt5Qt.QUrl.fromLocalFile(file_path)]
+        url_list = [pyqt5Qt.QUrl.fromLocalFile(file_path) for file_path in file_paths]
         mime_data = pyqt5Qt.QMimeData()
         mime_data.setUrls(url_list)
         clipboard.setMimeData(mime_data)
-        output(f"PDF\"{file_path}\" copy to clipboard")
+        metrics.record("clipboard", time.perf_counter() - clipboard_start)
+        for file_path in file_paths:
+            output(f"PDF\"{file_path}\" copy to clipboard")
 
     def set_theme(self, theme=None):
         if theme is None:
@@ -411,14 +3206,22 @@ class Main:
                 theme = None
             else:
                 theme = f"{self.app_theme}.xml"
-        qt_material.apply_stylesheet(app=app, theme=theme)
+        try:
+            apply_cached_theme(app, theme)
+        except Exception:
+            output(traceback.format_exc())
+            import qt_material
+            qt_material.apply_stylesheet(app=app, theme=theme)
 
-    def output(self, _str, print_time=True, precis_time=False) -> bool:
+    def format_output(self, _str, print_time=True, precis_time=False) -> str:
         if print_time:
             _time = self.current_time_str(year=precis_time, month=precis_time, day=precis_time, microsecond=precis_time)
             _str = f"[{_time}]{_str}"
+        return _str
+
+    def output(self, _str, print_time=True, precis_time=False) -> bool:
         try:
-            return self.main_ui.output(_str)
+            return self.main_ui.output(self.format_output(_str, print_time=print_time, precis_time=precis_time))
         except Exception:
             return False
 
@@ -431,6 +3234,74 @@ class Main:
         os.system(rf".\{NAME}.exe")
 
 
+def qt_material_path() -> str:
+    """Dir of the qt_material package, found without importing it."""
+    import importlib.util
+    return os.path.dirname(importlib.util.find_spec("qt_material").origin)
+
+
+def theme_cache_key(theme: str) -> str:
+    """Changes when qt_material, its template or the theme file change."""
+    package_path = qt_material_path()
+    key = [theme, sys.platform, "PyQt5"]
+    theme_path = theme if os.path.exists(theme) else os.path.join(package_path, "themes", theme)
+    for path in (os.path.join(package_path, "__init__.py"), os.path.join(package_path, "material.qss.template"),
+                 theme_path):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            key.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+    return hashlib.sha1("\n".join(key).encode("utf-8")).hexdigest()
+
+
+def apply_cached_theme(app_instance: QApplication, theme: (str, None)):
+    """
+    Apply a qt_material theme. The rendered stylesheet and the theme icons are kept in THEME_CACHE_DIR, so
+    qt_material is only imported and rendered again when the cache key changes.
+    """
+    app_instance.setStyle("Fusion")
+    if theme is None:
+        return
+    cache_dir_path = os.path.join(THEME_CACHE_DIR, os.path.splitext(os.path.basename(theme))[0])
+    stylesheet_path = os.path.join(cache_dir_path, "style.qss")
+    meta_path = os.path.join(cache_dir_path, "theme.json")
+    key = theme_cache_key(theme)
+    meta = None
+    try:
+        with open(meta_path, encoding="utf-8") as file:
+            meta = json.load(file)
+        with open(stylesheet_path, encoding="utf-8") as file:
+            stylesheet = file.read()
+    except (OSError, ValueError):
+        stylesheet = None
+    if meta is None or meta.get("key") != key or stylesheet is None \
+            or not os.path.isdir(os.path.join(cache_dir_path, "primary")):
+        import qt_material
+        os.makedirs(cache_dir_path, exist_ok=True)
+        # icons are generated into the cache dir
+        stylesheet = qt_material.build_stylesheet(theme, parent=os.path.abspath(cache_dir_path))
+        if stylesheet is None:
+            return
+        with open(stylesheet_path, "w", encoding="utf-8") as file:
+            file.write(stylesheet)
+        with open(meta_path, "w", encoding="utf-8") as file:
+            json.dump(dict(key=key, primary_color=qt_material.get_theme(theme)["primaryColor"]), file)
+        output(f"Theme \"{theme}\" cached in \"{cache_dir_path}\"")
+    else:
+        # what qt_material.build_stylesheet sets up besides the stylesheet
+        package_path = qt_material_path()
+        fonts_path = os.path.join(package_path, "fonts", "roboto")
+        for font in os.listdir(fonts_path):
+            if font.endswith(".ttf"):
+                QFontDatabase.addApplicationFont(os.path.join(fonts_path, font))
+        palette = QGuiApplication.palette()
+        primary_color = meta["primary_color"]
+        palette.setColor(QPalette.ColorRole.Text,
+                         QColor(*[int(primary_color[i:i + 2], 16) for i in range(1, 6, 2)] + [92]))
+        QGuiApplication.setPalette(palette)
+    QDir.setSearchPaths("icon", [os.path.abspath(cache_dir_path)])
+    app_instance.setStyleSheet(stylesheet)
+
+
 class KeySequenceEdit(QKeySequenceEdit):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -558,6 +3429,101 @@ class SettingCheckBox(QCheckBox):
         return self.isChecked()
 
 
+class SettingComboBox(QComboBox):
+    def __init__(self, values: list, parent=None, default_value=None, texts: list = None):
+        super().__init__()
+        self.parent = parent
+        self.values = list(values)
+        if texts is None:
+            texts = [str(value) for value in self.values]
+        self.addItems(texts)
+        if default_value in self.values:
+            self.setCurrentIndex(self.values.index(default_value))
+
+    def get_value(self):
+        return self.values[self.currentIndex()]
+
+
+class RegionSelector(QDialog):
+    """Translucent overlay over all screens, drag a rectangle to select it."""
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
+        self.setWindowOpacity(0.3)
+        self.setCursor(Qt.CrossCursor)
+        desktop_geometry = QRect()
+        for screen in QApplication.screens():
+            desktop_geometry = desktop_geometry.united(screen.geometry())
+        self.setGeometry(desktop_geometry)
+        self.rubber_band = QRubberBand(QRubberBand.Rectangle, self)
+        self.origin = None
+        self.region: (list, None) = None
+
+    def mousePressEvent(self, event):
+        self.origin = event.pos()
+        self.rubber_band.setGeometry(QRect(self.origin, self.origin))
+        self.rubber_band.show()
+
+    def mouseMoveEvent(self, event):
+        if self.origin is not None:
+            self.rubber_band.setGeometry(QRect(self.origin, event.pos()).normalized())
+
+    def mouseReleaseEvent(self, event):
+        if self.origin is None:
+            return
+        rect = QRect(self.origin, event.pos()).normalized()
+        if rect.width() < 2 or rect.height() < 2:
+            self.origin = None
+            self.rubber_band.hide()
+            return
+        top_left = self.mapToGlobal(rect.topLeft())
+        screen = QApplication.screenAt(top_left) or QApplication.primaryScreen()
+        # Qt works in logical pixels, screenshots in physical pixels
+        ratio = screen.devicePixelRatio()
+        self.region = [round(top_left.x() * ratio), round(top_left.y() * ratio),
+                       round(rect.width() * ratio), round(rect.height() * ratio)]
+        self.accept()
+
+    @classmethod
+    def select_region(cls) -> (list, None):
+        selector = cls()
+        if selector.exec_() == QDialog.Accepted:
+            return selector.region
+        return None
+
+
+class SettingRegion(QWidget):
+    def __init__(self, parent, default_value: list = None):
+        super().__init__()
+        self.parent = parent
+        self.value = default_value
+        layout = QHBoxLayout(self)
+        self.label = QLabel(self)
+        self.button = PushButton("Select", self)
+        self.button.clicked.connect(self.select)
+        layout.addWidget(self.label)
+        layout.addWidget(self.button)
+        self.update()
+
+    def select(self):
+        region = RegionSelector.select_region()
+        if region is not None:
+            self.value = region
+            self.update()
+
+    def get_value(self):
+        return self.value
+
+    def update(self) -> None:
+        super().update()
+        if self.value is None:
+            self.label.setText("None")
+        else:
+            left, top, width, height = self.value
+            self.label.setText(f"{width}x{height} at ({left}, {top})")
+
+
 class SettingsContainer(dict):
     class SettingPair(list):
         def __init__(self, key, value, value_get_callback: Callable = None):
@@ -607,7 +3573,42 @@ class SettingsManager:
         self.settings.add(note='Screenshot Shortcut', key='shortcuts_keys[0]')
         self.settings.add(note='Screenshot Notification', key='screenshot_notification_enable')
         self.settings.add(note='img Quality', key='img_quality')
+        self.settings.add(note='Image Format', key='img_format')
         self.settings.add(note='Theme', key='app_theme')
+        self.settings.add(note='Capture Workers', key='capture_workers')
+        self.settings.add(note='Capture Queue Size', key='capture_queue_size')
+        self.settings.add(note='PDF Streaming', key='pdf_streaming_enable')
+        self.settings.add(note='Crop Borders', key='crop_borders_enable')
+        self.settings.add(note='Crop Borders Padding', key='crop_borders_padding')
+        self.settings.add(note='Crop Borders Per Monitor', key='crop_borders_per_monitor')
+        self.settings.add(note='PDF Volume Pages', key='pdf_volume_pages')
+        self.settings.add(note='PDF Volume MB', key='pdf_volume_mb')
+        self.settings.add(note='Export Max Width', key='export_max_width')
+        self.settings.add(note='Export Max Height', key='export_max_height')
+        self.settings.add(note='Export DPI', key='export_dpi')
+        self.settings.add(note='Screen DPI', key='screen_dpi')
+        self.settings.add(note='Export Workers', key='export_workers')
+        self.settings.add(note='Duplicate Screenshots', key='duplicate_mode')
+        self.settings.add(note='Duplicate Threshold', key='duplicate_threshold')
+        self.settings.add(note='Capture Mode', key='capture_mode')
+        self.settings.add(note='Capture Region', key='capture_region')
+        self.settings.add(note='Capture Monitor', key='capture_monitor')
+        self.settings.add(note='Grab Backend', key='grab_backend')
+        self.settings.add(note='Pre-capture', key='precapture_enable')
+        self.settings.add(note='Pre-capture FPS', key='precapture_fps')
+        self.settings.add(note='Pre-capture Frames', key='precapture_frames')
+        self.settings.add(note='Pre-capture Memory MB', key='precapture_max_memory_mb')
+        self.settings.add(note='Session Storage', key='session_storage')
+        self.settings.add(note='Metrics Dump', key='metrics_dump_enable')
+        self.settings.add(note='Log Max Lines', key='log_max_lines')
+        self.settings.add(note='Session Recovery', key='recovery_enable')
+        self.settings.add(note='Notification Interval', key='notification_interval')
+        self.settings.add(note='Auto Capture', key='auto_capture_enable')
+        self.settings.add(note='Auto Capture Threshold', key='auto_capture_threshold')
+        self.settings.add(note='Auto Capture Min Interval', key='auto_capture_min_interval')
+        self.settings.add(note='Auto Capture Max Interval', key='auto_capture_max_interval')
+        self.settings.add(note='Auto Capture Sample Interval', key='auto_capture_sample_interval')
+        self.settings.add(note='Session Memory MB', key='session_memory_mb')
 
         if load_settings:
             self.load_settings()
@@ -634,6 +3635,15 @@ class SettingsManager:
                     if set(self.settings.keys()) == set(file_settings.keys()):
                         file_settings = SettingsContainer(_dict=file_settings)
                         self.settings.update(file_settings)
+                    elif defaults_settings is None:
+                        # settings added or removed: keep the known values, defaults for the new ones
+                        file_settings = SettingsContainer(_dict=file_settings)
+                        self.settings_filter(main_instance)
+                        for note in self.settings:
+                            file_setting_pair = file_settings.get(note)
+                            if file_setting_pair is not None and file_setting_pair.key == self.settings[note].key:
+                                self.settings[note] = file_setting_pair
+                        self.register_settings(self.settings)
                     else:
                         self.register_settings(defaults_settings)
             except Exception:
@@ -723,6 +3733,93 @@ class SettingsDialog(QDialog):
         screenshot_notification_layout.addStretch()
         layout.addLayout(screenshot_notification_layout)
 
+        # Auto Capture setting
+        auto_capture_layout = QHBoxLayout()
+        self.auto_capture_checkbox = SettingCheckBox(
+            text="Auto Capture on Screen Change",
+            parent=self,
+            default_value=self.current_settings.get("Auto Capture").value
+        )
+        self.new_settings.get("Auto Capture").value_get_callback = (
+            self.auto_capture_checkbox.get_value)
+        auto_capture_layout.addWidget(self.auto_capture_checkbox)
+        auto_capture_layout.addStretch()
+        layout.addLayout(auto_capture_layout)
+
+        # Capture Mode setting
+        capture_mode_layout = QHBoxLayout()
+        capture_mode_layout.addWidget(QLabel("Capture: "))
+        self.capture_mode_combobox = SettingComboBox(
+            values=["full", "active_window", "region", "monitor"],
+            texts=["Full Screen", "Active Window", "Region", "Monitor"],
+            parent=self,
+            default_value=self.current_settings.get("Capture Mode").value
+        )
+        self.new_settings.get("Capture Mode").value_get_callback = (
+            self.capture_mode_combobox.get_value)
+        capture_mode_layout.addWidget(self.capture_mode_combobox)
+        capture_mode_layout.addStretch()
+        layout.addLayout(capture_mode_layout)
+
+        # Capture Monitor setting
+        capture_monitor_layout = QHBoxLayout()
+        capture_monitor_layout.addWidget(QLabel("Monitor: "))
+        monitors = self.setting_manager.main_instance.get_screen_backend().monitors()
+        self.capture_monitor_combobox = SettingComboBox(
+            values=list(range(len(monitors))),
+            texts=[f"{index + 1}: {width}x{height} at ({left}, {top})"
+                   for index, (left, top, width, height) in enumerate(monitors)],
+            parent=self,
+            default_value=self.current_settings.get("Capture Monitor").value
+        )
+        self.new_settings.get("Capture Monitor").value_get_callback = (
+            self.capture_monitor_combobox.get_value)
+        capture_monitor_layout.addWidget(self.capture_monitor_combobox)
+        capture_monitor_layout.addStretch()
+        layout.addLayout(capture_monitor_layout)
+
+        # Capture Region setting
+        capture_region_layout = QHBoxLayout()
+        capture_region_layout.addWidget(QLabel("Region: "))
+        self.capture_region_selector = SettingRegion(
+            parent=self,
+            default_value=self.current_settings.get("Capture Region").value
+        )
+        self.new_settings.get("Capture Region").value_get_callback = (
+            self.capture_region_selector.get_value)
+        capture_region_layout.addWidget(self.capture_region_selector)
+        capture_region_layout.addStretch()
+        layout.addLayout(capture_region_layout)
+
+        # Grab Backend setting
+        grab_backend_layout = QHBoxLayout()
+        grab_backend_layout.addWidget(QLabel("Grab Backend: "))
+        self.grab_backend_combobox = SettingComboBox(
+            values=["auto"] + list(screen_backends),
+            parent=self,
+            default_value=self.current_settings.get("Grab Backend").value
+        )
+        self.new_settings.get("Grab Backend").value_get_callback = (
+            self.grab_backend_combobox.get_value)
+        grab_backend_layout.addWidget(self.grab_backend_combobox)
+        grab_backend_layout.addStretch()
+        layout.addLayout(grab_backend_layout)
+
+        # Session Storage setting
+        session_storage_layout = QHBoxLayout()
+        session_storage_layout.addWidget(QLabel("Session Storage: "))
+        self.session_storage_combobox = SettingComboBox(
+            values=["disk", "memory", "tiles"],
+            parent=self,
+            default_value=self.current_settings.get("Session Storage").value,
+            texts=["Disk", "Memory", "Disk, changed tiles only"]
+        )
+        self.new_settings.get("Session Storage").value_get_callback = (
+            self.session_storage_combobox.get_value)
+        session_storage_layout.addWidget(self.session_storage_combobox)
+        session_storage_layout.addStretch()
+        layout.addLayout(session_storage_layout)
+
         # apply button and cancel Button
         apply_cancel_layout = QHBoxLayout()
         self.apply_button = PushButton("Apply", self)
@@ -749,10 +3846,26 @@ class SettingsDialog(QDialog):
                 setting_pair.set_value(value_callback())
         self.setting_manager.save_settings(self.new_settings)
         self.setting_manager.load_settings()
+        # the backend setting may have changed
+        main_instance = self.setting_manager.main_instance
+        if main_instance.screen_backend is not None:
+            main_instance.screen_backend.close()
+            main_instance.screen_backend = None
         self.accept()  # Close the dialog
 
 
 class ScreenCatcherGUI(QWidget):
+    # batches of log lines, emitted by output_manager and appended in the GUI thread
+    log_batch = pyqtSignal(list)
+    # SessionJournal of sessions cut off by a crash, found in a thread on start
+    unfinished_sessions_found = pyqtSignal(list, list)
+    # ExportJob whose state or progress changed, emitted by the export queue
+    export_updated = pyqtSignal(object)
+    # a stopped session has finished its capture threads, a new one can start
+    catching_stopped = pyqtSignal()
+    # PDF paths and session Metrics, copied to the clipboard in the GUI thread
+    clipboard_requested = pyqtSignal(list, object)
+
     def __init__(self, parent: Main):
         super().__init__()
         self.parent = parent
@@ -773,9 +3886,39 @@ class ScreenCatcherGUI(QWidget):
         self.output_lines.setReadOnly(True)
         self.output_lines.setFontPointSize(self.line_font_size)
         self.output_lines.setLineWrapMode(QTextEdit.NoWrap)
-        self.output_lines.textChanged.connect(self.output_lines_auto_cursor_move)
+        # oldest lines are dropped, the full log is in LOG_DIR
+        self.output_lines.document().setMaximumBlockCount(self.parent.log_max_lines)
+        self.log_batch.connect(self.append_lines)
+        self.unfinished_sessions_found.connect(self.offer_recovery)
+        self.export_updated.connect(self.update_export)
+        self.catching_stopped.connect(self.on_catching_stopped)
+        # the export thread waits for the copy
+        self.clipboard_requested.connect(self.copy_to_clipboard, Qt.BlockingQueuedConnection)
         layout.addWidget(self.output_lines)
 
+        # Stats panel, refreshed from the session metrics
+        self.stats_label = QLabel(self)
+        self.stats_label.setFont(self.button_font)
+        self.stats_label.setWordWrap(True)
+        layout.addWidget(self.stats_label)
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(1000)
+
+        # Export progress of stopped sessions
+        export_layout = QHBoxLayout()
+        self.export_label = QLabel(self)
+        self.export_label.setFont(self.button_font)
+        self.cancel_export_button = PushButton('Cancel Export', self)
+        self.cancel_export_button.setFont(self.button_font)
+        self.cancel_export_button.setFixedWidth(128)
+        self.cancel_export_button.clicked.connect(self.cancel_export)
+        self.cancel_export_button.hide()
+        export_layout.addWidget(self.export_label)
+        export_layout.addStretch()
+        export_layout.addWidget(self.cancel_export_button)
+        layout.addLayout(export_layout)
+
         # Select-Save-Path button and Path-line edit
         path_layout = QHBoxLayout()
         self.path_button = PushButton('Select Save Path', self)
@@ -852,6 +3995,36 @@ class ScreenCatcherGUI(QWidget):
         # 移动窗口, 因为move方法只接受整数，所以我们类型转换一下
         self.move(new_left, new_top)
 
+    def update_stats(self):
+        self.stats_label.setText(self.parent.metrics.summary())
+
+    def update_export(self, job: ExportJob):
+        if job.state == "running":
+            text = f"Exporting \"{job.name}\": {job.done}/{job.total}"
+            eta = job.eta()
+            if eta is not None:
+                text += f", {eta:.0f} s left"
+        else:
+            text = f"Export \"{job.name}\" {job.state}"
+        queued = len(self.parent.export_queue.pending())
+        if queued:
+            text += f", {queued} more queued"
+        self.export_label.setText(text)
+        self.cancel_export_button.setVisible(self.parent.export_queue.busy())
+
+    def cancel_export(self):
+        self.parent.export_queue.cancel()
+
+    def on_catching_stopped(self):
+        self.update_start_stop_button()
+        self.update_path_line()
+
+    def copy_to_clipboard(self, file_paths: list, metrics: Metrics):
+        try:
+            self.parent.copy_file_to_clipboard(file_paths, metrics)
+        except Exception:
+            output(traceback.format_exc())
+
     def output_lines_auto_cursor_move(self):
         self.output_lines.moveCursor(QTextCursor.End)
         self.output_lines.moveCursor(QTextCursor.StartOfLine)
@@ -919,6 +4092,7 @@ class ScreenCatcherGUI(QWidget):
     @staticmethod
     def show_notification(message: str, title: str, app_name: str = NAME, timeout: int = 5,
                           app_icon: str = ICON_PATH):
+        from plyer import notification
         notification.notify(
             title=title,
             message=message,
@@ -929,11 +4103,42 @@ class ScreenCatcherGUI(QWidget):
 
     def output(self, _str) -> bool:
         try:
-            self.output_lines.append(_str)
+            self.log_batch.emit([_str])
         except Exception:
             return False
         return True
 
+    def offer_recovery(self, journals: list, frames: list):
+        lines = [f"{os.path.basename(journal.dir_path)}: {count} screenshots -> "
+                 f"{journal.data.get('pdf_save_path')}" for journal, count in zip(journals, frames)]
+        box = QMessageBox(self)
+        box.setWindowTitle("ScreenCatcher")
+        box.setText(f"{len(journals)} catching sessions were not saved:\n" + "\n".join(lines[-10:]))
+        export_button = box.addButton("Export", QMessageBox.AcceptRole)
+        resume_button = box.addButton("Resume Last", QMessageBox.ActionRole)
+        discard_button = box.addButton("Discard", QMessageBox.DestructiveRole)
+        box.addButton("Later", QMessageBox.RejectRole)
+        box.exec_()
+        clicked = box.clickedButton()
+        if clicked == export_button:
+            self.parent.export_unfinished_sessions(journals)
+        elif clicked == resume_button:
+            # the others are exported, the last one goes on catching
+            self.parent.export_unfinished_sessions(journals[:-1])
+            self.parent.catching_start(resume_journal=journals[-1])
+            self.update_start_stop_button()
+        elif clicked == discard_button:
+            self.parent.discard_unfinished_sessions(journals)
+
+    def append_lines(self, lines: list):
+        document = self.output_lines.document()
+        if document.maximumBlockCount() != self.parent.log_max_lines:
+            document.setMaximumBlockCount(self.parent.log_max_lines)
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(("\n" if not document.isEmpty() else "") + "\n".join(lines))
+        self.output_lines_auto_cursor_move()
+
     def exit(self):
         if self.parent.catching_state:
             _reply = QMessageBox.question(self, "ScreenCatcher",
@@ -943,31 +4148,144 @@ class ScreenCatcherGUI(QWidget):
                     return
             else:
                 return
+        if self.parent.stopping or self.parent.export_queue.busy():
+            output("Waiting for the PDFs to be saved")
+            self.exit_button.setEnabled(False)
+            self.parent.wait_exports()
         self.close()
         app.closeAllWindows()
 
 
 def output(_str, print_time=True, precis_time=False):
-    output_queue.put(dict(_str=_str, print_time=print_time, precis_time=precis_time))
+    global output_dropped
+    try:
+        output_queue.put_nowait(dict(_str=_str, print_time=print_time, precis_time=precis_time))
+    except Full:
+        # never block a capture thread on logging
+        output_dropped += 1
+
+
+def create_file_logger() -> logging.Logger:
+    """Logger writing the full history to a rotating file in LOG_DIR."""
+    logger = logging.getLogger(NAME)
+    logger.propagate = False
+    if not logger.handlers:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(os.path.join(LOG_DIR, f"{NAME}.log"), maxBytes=4 * 1024 * 1024,
+                                                       backupCount=4, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    return logger
 
 
 @Threaded
-def output_manager():
+def output_manager(interval: float = 0.1, batch_size: int = 1000):
+    global output_dropped
+    try:
+        logger = create_file_logger()
+    except Exception:
+        print(traceback.format_exc())
+        logger = None
     while True:
-        _dict: dict = output_queue.get()
-        _str = _dict.get("_str")
-        print_time = _dict.get("print_time")
-        precis_time = _dict.get("precis_time")
-        print(_str)
+        # lines arriving within `interval` of the first one go to the GUI together
+        batch = [output_queue.get()]
+        time.sleep(interval)
+        while len(batch) < batch_size:
+            try:
+                batch.append(output_queue.get_nowait())
+            except Empty:
+                break
+        lines = []
+        if output_dropped:
+            lines.append(f"Warning: {output_dropped} log lines dropped")
+            output_dropped = 0
+        for _dict in batch:
+            lines.append(main.format_output(_dict.get("_str"), print_time=_dict.get("print_time"),
+                                            precis_time=_dict.get("precis_time")))
+        print("\n".join(lines))
         try:
-            main.output(_str, print_time=print_time, precis_time=precis_time)
+            if logger is not None:
+                for line in lines:
+                    logger.info(line)
+            main.main_ui.log_batch.emit(lines)
         except Exception:
             print(traceback.format_exc())
 
 
+def export_main(argv: list) -> int:
+    """
+    Export session dirs to PDF without the GUI: `main.py export DIR [DIR ...]`.
+    Print a JSON summary, return 0 if every dir was exported, 1 otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog=f"{NAME} export", description="Export screenshot session dirs to PDF")
+    parser.add_argument("dirs", nargs="+", help="session dirs")
+    parser.add_argument("-o", "--output-dir", help="dir for the PDFs, default next to each session dir")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="sessions exported at once, 0: one per core")
+    parser.add_argument("--volume-pages", type=int, default=0, help="split PDFs past this many pages, 0: no limit")
+    parser.add_argument("--volume-mb", type=float, default=0, help="split PDFs past this many MiB, 0: no limit")
+    parser.add_argument("--max-width", type=int, default=0, help="downscale pages to this many pixels wide")
+    parser.add_argument("--max-height", type=int, default=0, help="downscale pages to this many pixels high")
+    parser.add_argument("--dpi", type=float, default=0, help="downscale pages to this DPI")
+    parser.add_argument("--screen-dpi", type=float, default=96, help="DPI of the screenshots, default 96")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality of downscaled pages")
+    parser.add_argument("--crop-borders", action="store_true", help="crop off what is the same on every page")
+    parser.add_argument("--crop-padding", type=int, default=16, help="pixels kept around what changes, default 16")
+    parser.add_argument("--crop-shared", action="store_true",
+                        help="one crop box for pages of every size instead of one per monitor")
+    parser.add_argument("--summary", help="also write the JSON summary to this file")
+    args = parser.parse_args(argv)
+    max_pages, max_bytes = args.volume_pages, int(args.volume_mb * 1024 * 1024)
+    scale = ExportScale(args.max_width, args.max_height, args.dpi, args.screen_dpi, args.quality)
+    crop = BorderCrop(args.crop_padding, per_monitor=not args.crop_shared) if args.crop_borders else None
+
+    jobs = min(export_worker_count(args.jobs), len(args.dirs))
+    tasks = []
+    for img_dir_path in args.dirs:
+        img_dir_path = os.path.abspath(img_dir_path)
+        pdf_name = os.path.basename(img_dir_path.rstrip(os.sep)) + ".pdf"
+        pdf_dir_path = os.path.dirname(img_dir_path) if args.output_dir is None else os.path.abspath(args.output_dir)
+        tasks.append((img_dir_path, os.path.join(pdf_dir_path, pdf_name)))
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    if jobs <= 1:
+        # one session: its pages are prepared in parallel instead
+        sessions = [export_session(img_dir_path, pdf_save_path, 0, max_pages, max_bytes, scale, crop)
+                    for img_dir_path, pdf_save_path in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            sessions = list(executor.map(export_session, *zip(*tasks), [1] * len(tasks), [max_pages] * len(tasks),
+                                         [max_bytes] * len(tasks), [scale] * len(tasks), [crop] * len(tasks)))
+    for session in sessions:
+        for message in session.pop("messages"):
+            print(message, file=sys.stderr)
+        if session["error"] is not None:
+            print(f"{session['dir']}: {session['error']}", file=sys.stderr)
+    failed = sum(session["error"] is not None for session in sessions)
+    summary = dict(sessions=sessions, exported=len(sessions) - failed, failed=failed,
+                   pages=sum(session["pages"] for session in sessions),
+                   bytes=sum(session["bytes"] for session in sessions),
+                   time=round(time.perf_counter() - start, 3))
+    summary_json = json.dumps(summary, indent=2, ensure_ascii=False)
+    print(summary_json)
+    if args.summary is not None:
+        with open(args.summary, "w", encoding="utf-8") as file:
+            file.write(summary_json)
+    return 1 if failed else 0
+
+
+output_queue = Queue(maxsize=10000)
+output_dropped = 0
+
 if __name__ == '__main__':
+    # export process pool in the frozen exe
+    multiprocessing.freeze_support()
+    if sys.argv[1:2] == ["export"]:
+        sys.exit(export_main(sys.argv[2:]))
     try:
-        output_queue = Queue()
         app = QApplication(sys.argv)
         main = Main()
         output_manager()